@@ -4,7 +4,7 @@ GraphRAG 三元组提取工具
 """
 
 import pandas as pd
-import json
+import orjson
 import os
 from typing import List, Dict, Any
 from datetime import datetime
@@ -155,9 +155,12 @@ class GraphRAGExtractor:
             'triples': triples
         }
 
-        # 保存 JSON 文件
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 保存 JSON 文件（orjson 直接输出 UTF-8 字节）
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(
+                data,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            ))
 
         print(f"[SUCCESS] 数据已提取至: {output_path}")
         return output_path
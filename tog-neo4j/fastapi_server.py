@@ -1,20 +1,31 @@
+import asyncio
+import atexit
+import importlib.util
 import logging
+import logging.handlers
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, UploadFile, File, HTTPException, status, Form, BackgroundTasks
 from fastapi.responses import JSONResponse
 import os
+import queue
+import selectors
 import shutil
 import subprocess
+import threading
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import re
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
+import orjson
 from datetime import datetime
+from difflib import SequenceMatcher
 from neo4j_connector import Neo4jConnector
-from tog_reasoning import ToGReasoning
+from tog_reasoning import ToGReasoning, close_llm_client
 from deal_graph import main as deal_graph_main
 from insert_to_neo4j import main as insert_neo4j_main
 from ywretriever import crtDenseRetriever
+from llm_cache import SemanticCache, make_cache_key
 from Response import R  # 导入统一响应类
 
 # ====================================================================================================================================================================================
@@ -25,16 +36,77 @@ from Response import R  # 导入统一响应类
 # ============================================================
 # 配置CORS - 允许跨域请求
 # ============================================================
-logging.basicConfig(level=logging.INFO)
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+# 日志文件路径,未设置时只输出到控制台;单个文件上限与保留的历史文件数
+LOG_FILE = os.getenv("LOG_FILE") or None
+LOG_FILE_MAX_BYTES = 100 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+
+
+def setup_logging(level: int = logging.INFO):
+    """
+    配置根日志:业务线程格式化日志记录后放入队列,写控制台/文件等处理器I/O由后台监听线程完成
+
+    已由其他模块 basicConfig 挂到根日志上的处理器会被移入监听线程,输出格式不变;
+    设置了 LOG_FILE 时额外写入按大小滚动的日志文件
+
+    Args:
+        level: 根日志级别
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if not handlers:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handlers.append(console_handler)
+    for handler in handlers:
+        root.removeHandler(handler)
+    if LOG_FILE:
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE,
+            maxBytes=LOG_FILE_MAX_BYTES,
+            backupCount=LOG_FILE_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True
+        )
+        file_handler.setFormatter(logging.Formatter("%(asctime)s " + logging.BASIC_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    # 退出时排空队列中剩余的日志
+    atexit.register(_log_listener.stop)
+
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 RETRIEVER_PATH_BASE = "../graphrag"
 ENTITY_LINKING_THRESHOLD = 15.0
 
+# ToG 辅助调用（实体抽取、关系/实体选择）使用的轻量模型，未配置时与主模型相同；评估并作答始终使用主模型
+TOG_AUX_LLM_MODEL = os.getenv("TOG_AUX_LLM_MODEL") or None
+
 # Java后端接口配置
 JAVA_BACKEND_URL = os.getenv("JAVA_BACKEND_URL", "http://localhost:8080")  # 根据实际情况修改
 JAVA_CALLBACK_PATH = "/graph/response"
 
+# 通知Java后端的共享客户端(保持长连接),首次使用时创建
+_callback_client: Optional[httpx.AsyncClient] = None
+
+# 安装了 h2 (httpx[http2]) 时回调客户端启用 HTTP/2;仅对 https 的 JAVA_BACKEND_URL 生效,
+# 明文 http 不做 HTTP/2 升级,仍走 HTTP/1.1
+CALLBACK_HTTP2 = importlib.util.find_spec("h2") is not None
+
 app = FastAPI(title="ToG Knowledge Graph API")
 
 app.add_middleware(
@@ -50,16 +122,60 @@ app.add_middleware(
 # ============================================================
 
 db_connections: Dict[str, Neo4jConnector] = {}
+# 建图任务在线程池中也会获取连接,写 db_connections 时加锁
+_db_connections_lock = threading.Lock()
 
 DEFAULT_NEO4J_CONFIG = {
     "uri": "bolt://localhost:7687",
     "username": "neo4j",
-    "password": "jbh966225"
+    "password": "jbh966225",
+    "database": os.getenv("NEO4J_DATABASE") or None,
+    "max_connection_pool_size": int(os.getenv("NEO4J_POOL_SIZE", "100")),
+    "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "60")),
+    "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+    "fetch_size": int(os.getenv("NEO4J_FETCH_SIZE", "1000"))
 }
 
 GRAPHRAG_ROOT = "../graphrag"
 BASE_SETTINGS_PATH = os.path.join(GRAPHRAG_ROOT, "settings.yaml")
 
+# 混合查询整合答案的语义缓存
+integration_cache = SemanticCache(max_size=512, ttl=3600.0, similarity_threshold=0.92)
+
+# 两个答案相似度超过该值时视为一致,跳过整合
+INTEGRATION_SIMILARITY_THRESHOLD = 0.9
+
+# 混合查询整合答案的提示词模板
+INTEGRATION_PROMPT_TEMPLATE = """你是一个知识图谱查询助手。我使用两种不同的方法查询了同一个问题，现在需要你整合两个答案，给出最准确、最全面的回答。
+
+**问题：** {question}
+
+**方法1 - ToG（思维图谱）的答案：**
+{tog_answer}
+
+**方法2 - GraphRAG的答案：**
+{graphrag_answer}
+
+请综合以上两个答案，给出一个最终答案。要求：
+1. 综合两个答案的优点和补充信息
+2. 避免重复
+3. 确保回答的准确性和完整性
+4. 如果两个答案有冲突，说明你的判断依据
+5. 用清晰、结构化的方式(1、2、3...)呈现答案
+
+最终答案："""
+
+# 同时在线程中执行的阻塞查询(ToG推理 / GraphRAG命令)上限
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "16"))
+query_semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+# asyncio.to_thread 使用的默认线程池大小(图查询、向量编码、子进程等阻塞调用共用)
+BLOCKING_POOL_WORKERS = int(os.getenv("BLOCKING_POOL_WORKERS", "32"))
+
+# 调用大模型HTTP接口的共享客户端(复用连接池),首次使用时创建
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "64"))
+_llm_http_client: Optional[httpx.AsyncClient] = None
+
 
 # ====================================================================================================================================================================================
 # /配置信息
@@ -114,6 +230,18 @@ class ToGGraphRAGQueryRequest(BaseModel):
 # 回调通知函数
 # ============================================================
 
+def get_callback_client() -> httpx.AsyncClient:
+    """获取通知Java后端的共享客户端"""
+    global _callback_client
+    if _callback_client is None or _callback_client.is_closed:
+        _callback_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            http2=CALLBACK_HTTP2
+        )
+    return _callback_client
+
+
 async def notify_java_backend(grag_id: str, success: bool, message: str,
                               file_saved: Optional[str] = None,
                               error: Optional[str] = None,
@@ -146,20 +274,23 @@ async def notify_java_backend(grag_id: str, success: bool, message: str,
     }
 
     try:
-        logger.info(f"[{grag_id}] 📤 发送结果通知到Java后端: {callback_url}")
+        logger.info("[%s] 📤 发送结果通知到Java后端: %s", grag_id, callback_url)
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(callback_url, json=payload)
+        response = await get_callback_client().post(
+            callback_url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
 
-            if response.status_code == 200:
-                logger.info(f"[{grag_id}] ✅ 成功通知Java后端")
-            else:
-                logger.warning(f"[{grag_id}] ⚠️ Java后端返回非200状态码: {response.status_code}")
+        if response.status_code == 200:
+            logger.info("[%s] ✅ 成功通知Java后端", grag_id)
+        else:
+            logger.warning("[%s] ⚠️ Java后端返回非200状态码: %s", grag_id, response.status_code)
 
     except httpx.TimeoutException:
-        logger.error(f"[{grag_id}] ❌ 通知Java后端超时")
+        logger.error("[%s] ❌ 通知Java后端超时", grag_id)
     except Exception as e:
-        logger.error(f"[{grag_id}] ❌ 通知Java后端失败: {e}", exc_info=True)
+        logger.error("[%s] ❌ 通知Java后端失败: %s", grag_id, e, exc_info=True)
 
 
 # ============================================================
@@ -178,7 +309,7 @@ def export_nodes_to_csv(grag_id: str, user_path: str) -> bool:
         是否成功
     """
     try:
-        logger.info(f"[{grag_id}] 📤 开始导出节点到CSV")
+        logger.info("[%s] 📤 开始导出节点到CSV", grag_id)
 
         # 使用已有的 Neo4j 连接配置
         connector = get_neo4j_connector(grag_id)
@@ -190,7 +321,7 @@ def export_nodes_to_csv(grag_id: str, user_path: str) -> bool:
         RETURN elementId(n) AS id, COALESCE(n.name, '') AS name
         """
 
-        with connector.driver.session() as session:
+        with connector.session() as session:
             # 在 session.run 中传递参数 grag_id
             result = session.run(query, {"grag_id": grag_id})
 
@@ -198,7 +329,7 @@ def export_nodes_to_csv(grag_id: str, user_path: str) -> bool:
             nodes_data = [record.data() for record in result]
 
             if not nodes_data:
-                logger.warning(f"[{grag_id}] ⚠️ 数据库中没有匹配该 grag_id 的节点数据")
+                logger.warning("[%s] ⚠️ 数据库中没有匹配该 grag_id 的节点数据", grag_id)
                 return False
 
             # 转换为DataFrame并保存
@@ -209,12 +340,12 @@ def export_nodes_to_csv(grag_id: str, user_path: str) -> bool:
             csv_path = os.path.join(user_path, "nodes_pandas.csv")
             df.to_csv(csv_path, index=False, encoding='utf-8')
 
-            logger.info(f"[{grag_id}] ✅ 节点导出完成: {csv_path} ({len(nodes_data)} 个节点)")
+            logger.info("[%s] ✅ 节点导出完成: %s (%s 个节点)", grag_id, csv_path, len(nodes_data))
             return True
 
 
     except Exception as e:
-        logger.error(f"[{grag_id}] ❌ 导出节点到CSV失败: {e}", exc_info=True)
+        logger.error("[%s] ❌ 导出节点到CSV失败: %s", grag_id, e, exc_info=True)
         return False
 
 
@@ -226,6 +357,7 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
                             user_path: str, input_dir: str):
     """
     后台任务：执行图谱创建的完整流程
+    各步骤均为阻塞的命令行/数据库/文件操作，放到线程中执行，避免阻塞事件循环
 
     Args:
         file_path: 上传文件的完整路径
@@ -235,14 +367,15 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
         input_dir: 输入目录路径
     """
     try:
-        logger.info(f"[{grag_id}] 📄 开始后台图谱创建任务")
+        logger.info("[%s] 📄 开始后台图谱创建任务", grag_id)
         TOTAL_STEPS = 7
 
         # 步骤1: 初始化GraphRAG
         log_step(1, TOTAL_STEPS, "初始化GraphRAG配置", grag_id)
         init_command = f"python -m graphrag init --root {user_path}"
 
-        success, stdout, stderr = run_command_with_progress(
+        success, stdout, stderr = await asyncio.to_thread(
+            run_command_with_progress,
             init_command,
             "GraphRAG初始化",
             grag_id
@@ -262,23 +395,24 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
         log_step(2, TOTAL_STEPS, "配置settings.yaml", grag_id)
         user_settings_path = os.path.join(user_path, "settings.yaml")
         if os.path.exists(BASE_SETTINGS_PATH):
-            shutil.copy2(BASE_SETTINGS_PATH, user_settings_path)
-            logger.info(f"[{grag_id}] ✅ 配置文件已复制")
+            await asyncio.to_thread(shutil.copy2, BASE_SETTINGS_PATH, user_settings_path)
+            logger.info("[%s] ✅ 配置文件已复制", grag_id)
         else:
-            logger.warning(f"[{grag_id}] ⚠️ 基础配置文件不存在: {BASE_SETTINGS_PATH}")
+            logger.warning("[%s] ⚠️ 基础配置文件不存在: %s", grag_id, BASE_SETTINGS_PATH)
 
         # 步骤3: 构建索引
         log_step(3, TOTAL_STEPS, "构建知识图谱索引 (这可能需要几分钟)", grag_id)
         index_command = f"python -m graphrag index --root {user_path}"
 
-        success, stdout, stderr = run_command_with_progress(
+        success, stdout, stderr = await asyncio.to_thread(
+            run_command_with_progress,
             index_command,
             "索引构建",
             grag_id
         )
 
         if not success:
-            logger.error(f"[{grag_id}] ❌ 索引构建失败")
+            logger.error("[%s] ❌ 索引构建失败", grag_id)
             await notify_java_backend(
                 grag_id=grag_id,
                 success=False,
@@ -292,10 +426,12 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
         log_step(4, TOTAL_STEPS, "提取三元组数据", grag_id)
         deal_graph_input_dir = os.path.join(user_path, "output")
 
-        extracted_json_path = deal_graph_main(input_dir=deal_graph_input_dir, grag_id=grag_id)
+        extracted_json_path = await asyncio.to_thread(
+            deal_graph_main, input_dir=deal_graph_input_dir, grag_id=grag_id
+        )
 
         if not extracted_json_path:
-            logger.error(f"[{grag_id}] ❌ 三元组提取失败")
+            logger.error("[%s] ❌ 三元组提取失败", grag_id)
             await notify_java_backend(
                 grag_id=grag_id,
                 success=False,
@@ -305,15 +441,15 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
             )
             return
 
-        logger.info(f"[{grag_id}] ✅ 三元组提取完成: {extracted_json_path}")
+        logger.info("[%s] ✅ 三元组提取完成: %s", grag_id, extracted_json_path)
 
         # 步骤5: 导入数据到 Neo4j
         log_step(5, TOTAL_STEPS, "导入数据到 Neo4j 数据库", grag_id)
 
-        import_success = insert_neo4j_main(json_file=extracted_json_path)
+        import_success = await asyncio.to_thread(insert_neo4j_main, json_file=extracted_json_path)
 
         if not import_success:
-            logger.error(f"[{grag_id}] ❌ 数据库导入失败")
+            logger.error("[%s] ❌ 数据库导入失败", grag_id)
             await notify_java_backend(
                 grag_id=grag_id,
                 success=False,
@@ -323,28 +459,33 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
             )
             return
 
-        logger.info(f"[{grag_id}] ✅ 数据库导入完成")
+        logger.info("[%s] ✅ 数据库导入完成", grag_id)
+        # 图谱数据已变更,缓存的选择/评估结果可能失效
+        ToGReasoning.clear_cache()
 
         # 【新增】步骤6: 导出节点到CSV
         log_step(6, TOTAL_STEPS, "导出节点到CSV文件（用于实体链接）", grag_id)
-        export_success = export_nodes_to_csv(grag_id=grag_id, user_path=user_path)
+        export_success = await asyncio.to_thread(export_nodes_to_csv, grag_id=grag_id, user_path=user_path)
 
         if not export_success:
-            logger.warning(f"[{grag_id}] ⚠️ 节点导出到CSV失败，但不影响整体流程")
+            logger.warning("[%s] ⚠️ 节点导出到CSV失败，但不影响整体流程", grag_id)
             # 注意：这里不返回，继续通知Java后端（主流程已完成）
         else:
-            logger.info(f"[{grag_id}] ✅ 节点导出成功")
+            logger.info("[%s] ✅ 节点导出成功", grag_id)
 
         log_step(7, TOTAL_STEPS, "根据csv文件建立密集索引", grag_id)
-        retriv_dir = crtDenseRetriever(retriv_dir=os.path.join(user_path, ".retrive"),
-                                       file_path=os.path.join(user_path, "nodes_pandas.csv"))
+        retriv_dir = await asyncio.to_thread(
+            crtDenseRetriever,
+            retriv_dir=os.path.join(user_path, ".retrive"),
+            file_path=os.path.join(user_path, "nodes_pandas.csv")
+        )
         if retriv_dir:
-            logger.info(f"[{grag_id}] ✅ 索引创建成功: {retriv_dir}")
+            logger.info("[%s] ✅ 索引创建成功: %s", grag_id, retriv_dir)
         else:
-            logger.warning(f"[{grag_id}] ⚠️ 索引创建失败")
+            logger.warning("[%s] ⚠️ 索引创建失败", grag_id)
 
         # 全部成功，通知Java后端
-        logger.info(f"[{grag_id}] 🎉 全流程完成！")
+        logger.info("[%s] 🎉 全流程完成！", grag_id)
         await notify_java_backend(
             grag_id=grag_id,
             success=True,
@@ -355,7 +496,7 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
         )
 
     except Exception as e:
-        logger.error(f"[{grag_id}] ❌ 后台任务异常: {e}", exc_info=True)
+        logger.error("[%s] ❌ 后台任务异常: %s", grag_id, e, exc_info=True)
         await notify_java_backend(
             grag_id=grag_id,
             success=False,
@@ -369,6 +510,127 @@ async def create_graph_task(file_path: str, filename: str, grag_id: str,
 # 辅助函数：简洁的subprocess执行
 # ============================================================
 
+# 已安装 RE2 时用其编译关键信息过滤模式(DFA 线性扫描,无回溯),否则使用标准库 re
+try:
+    import re2 as _filter_re
+except ImportError:
+    _filter_re = re
+
+# 子进程输出中需要显示的关键信息模式(直接匹配未解码的原始字节)
+# 忽略大小写写在模式内,re 与 RE2 均支持
+_IMPORTANT_RE = _filter_re.compile(('(?i)' + '|'.join([
+    r'Loading',
+    r'Processing',
+    r'Creating',
+    r'Building',
+    r'Indexing',
+    r'Complete',
+    r'Success',
+    r'Error',
+    r'Warning',
+    r'progress',
+    r'⠋|⠙|⠹|⠸|⠼|⠴|⠦|⠧|⠇|⠏',  # 进度spinner
+    r'\d+%',  # 百分比
+    r'Extracting',
+    r'Embedding',
+    r'Graph',
+])).encode('utf-8'))
+
+# ANSI颜色转义序列(匹配原始字节)
+_ANSI_SHORT_RE = re.compile(rb'\x1B\[[0-9;]*m')
+
+# 子进程输出的换行符(\r 单独出现时同样视为换行,与文本模式的通用换行一致)
+_LINE_BREAK_RE = re.compile(rb'\r\n|\r|\n')
+
+# 每次从管道读取的最大字节数
+_PIPE_READ_SIZE = 65536
+
+
+def _split_lines(buffer: bytearray) -> List[bytes]:
+    """
+    从缓冲区中取出所有完整的行(不含换行符),未结束的部分留在缓冲区中
+
+    Args:
+        buffer: 累积的管道输出
+
+    Returns:
+        完整行列表
+    """
+    # 末尾的 \r 可能与下一块数据开头的 \n 组成 \r\n,暂不处理
+    end = len(buffer) - 1 if buffer.endswith(b'\r') else len(buffer)
+    parts = _LINE_BREAK_RE.split(bytes(buffer[:end]))
+    del buffer[:end - len(parts[-1])]
+    return parts[:-1]
+
+
+def _decode_output(buffer: bytearray) -> str:
+    """将累积的原始输出一次性解码,并统一换行符"""
+    return buffer.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _iter_process_output(process: subprocess.Popen):
+    """
+    同时读取子进程的 stdout/stderr,按到达顺序产出 (是否stderr, 本次读到的原始数据, 其中的完整行)
+
+    POSIX 下用 selectors 同时等待两个非阻塞管道,每次整块读取;
+    其他平台的管道不支持 select,改为每个管道一个读线程
+    """
+    if os.name != "posix":
+        yield from _iter_process_output_threaded(process)
+        return
+
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    for is_stderr, pipe in ((False, process.stdout), (True, process.stderr)):
+        os.set_blocking(pipe.fileno(), False)
+        selector.register(pipe.fileno(), selectors.EVENT_READ, is_stderr)
+        buffers[pipe.fileno()] = bytearray()
+
+    try:
+        while selector.get_map():
+            for key, _ in selector.select(timeout=0.1):
+                try:
+                    chunk = os.read(key.fd, _PIPE_READ_SIZE)
+                except BlockingIOError:
+                    continue
+
+                buffer = buffers[key.fd]
+                if chunk:
+                    buffer += chunk
+                    lines = _split_lines(buffer)
+                else:
+                    # 管道已关闭,剩余内容作为最后一行
+                    selector.unregister(key.fd)
+                    lines = _LINE_BREAK_RE.split(bytes(buffer)) if buffer else []
+                    buffer.clear()
+
+                yield key.data, chunk, lines
+    finally:
+        selector.close()
+
+
+def _iter_process_output_threaded(process: subprocess.Popen):
+    """_iter_process_output 在不支持 select 管道的平台上的实现"""
+    lines = queue.Queue()
+
+    def pump(pipe, is_stderr):
+        for raw in iter(pipe.readline, b''):
+            lines.put((is_stderr, raw))
+        lines.put(None)
+
+    for is_stderr, pipe in ((False, process.stdout), (True, process.stderr)):
+        threading.Thread(target=pump, args=(pipe, is_stderr), daemon=True).start()
+
+    finished = 0
+    while finished < 2:
+        item = lines.get()
+        if item is None:
+            finished += 1
+            continue
+        is_stderr, raw = item
+        yield is_stderr, raw, [raw]
+
+
 def run_command_with_progress(command: str, description: str, grag_id: str = None) -> tuple[bool, str, str]:
     """
     执行命令并显示简洁的进度信息
@@ -382,93 +644,58 @@ def run_command_with_progress(command: str, description: str, grag_id: str = Non
         (success, stdout, stderr)
     """
     prefix = f"[{grag_id}]" if grag_id else ""
-    logger.info(f"{prefix} 🚀 开始: {description}")
-    logger.info(f"{prefix} 💻 命令: {command}")
+    logger.info("%s 🚀 开始: %s", prefix, description)
+    logger.info("%s 💻 命令: %s", prefix, command)
 
     try:
         process = subprocess.Popen(
             command,
             shell=True,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
-            bufsize=1,
-            universal_newlines=True
+            stderr=subprocess.PIPE
         )
 
-        # 收集输出
-        stdout_lines = []
-        stderr_lines = []
-
-        # 定义需要显示的关键信息模式
-        important_patterns = [
-            r'Loading',
-            r'Processing',
-            r'Creating',
-            r'Building',
-            r'Indexing',
-            r'Complete',
-            r'Success',
-            r'Error',
-            r'Warning',
-            r'progress',
-            r'⠋|⠙|⠹|⠸|⠼|⠴|⠦|⠧|⠇|⠏',  # 进度spinner
-            r'\d+%',  # 百分比
-            r'Extracting',
-            r'Embedding',
-            r'Graph',
-        ]
-
-        pattern = re.compile('|'.join(important_patterns), re.IGNORECASE)
-
-        # 实时读取输出
-        while True:
-            # 读取stdout
-            stdout_line = process.stdout.readline()
-            if stdout_line:
-                stdout_lines.append(stdout_line)
-                # 只显示重要信息
-                clean_line = stdout_line.strip()
-                if clean_line and pattern.search(clean_line):
-                    # 移除ANSI转义序列
-                    clean_line = re.sub(r'\x1B\[[0-9;]*m', '', clean_line)
-                    logger.info(f"{prefix} 📝 {clean_line}")
-
-            # 读取stderr
-            stderr_line = process.stderr.readline()
-            if stderr_line:
-                stderr_lines.append(stderr_line)
-                clean_line = stderr_line.strip()
-                if clean_line and pattern.search(clean_line):
-                    clean_line = re.sub(r'\x1B\[[0-9;]*m', '', clean_line)
-                    logger.warning(f"{prefix} ⚠️ {clean_line}")
-
-            # 检查进程是否结束
-            if stdout_line == '' and stderr_line == '' and process.poll() is not None:
-                break
+        # 收集原始输出,结束后一次性解码
+        stdout_buffer = bytearray()
+        stderr_buffer = bytearray()
+
+        # 实时读取输出,两个管道同时等待,互不阻塞
+        for is_stderr, chunk, lines in _iter_process_output(process):
+            (stderr_buffer if is_stderr else stdout_buffer).extend(chunk)
+            for line in lines:
+                # 只显示重要信息,仅解码需要显示的行
+                line = line.strip()
+                if not line or not _IMPORTANT_RE.search(line):
+                    continue
+                # 移除ANSI转义序列;绝大多数行不含 ESC,先用字节查找判断,避免进入正则
+                if b'\x1b' in line:
+                    line = _ANSI_SHORT_RE.sub(b'', line)
+                clean_line = line.decode('utf-8', errors='replace')
+                if is_stderr:
+                    logger.warning("%s ⚠️ %s", prefix, clean_line)
+                else:
+                    logger.info("%s 📝 %s", prefix, clean_line)
 
         returncode = process.wait()
-        stdout = ''.join(stdout_lines)
-        stderr = ''.join(stderr_lines)
+        stdout = _decode_output(stdout_buffer)
+        stderr = _decode_output(stderr_buffer)
 
         if returncode == 0:
-            logger.info(f"{prefix} ✅ 完成: {description}")
+            logger.info("%s ✅ 完成: %s", prefix, description)
             return True, stdout, stderr
         else:
-            logger.error(f"{prefix} ❌ 失败: {description} (返回码: {returncode})")
+            logger.error("%s ❌ 失败: %s (返回码: %s)", prefix, description, returncode)
             return False, stdout, stderr
 
     except Exception as e:
-        logger.error(f"{prefix} ❌ 异常: {description} - {str(e)}")
+        logger.error("%s ❌ 异常: %s - %s", prefix, description, str(e))
         return False, "", str(e)
 
 
 def log_step(step_num: int, total_steps: int, description: str, grag_id: str = None):
     """记录步骤信息"""
     prefix = f"[{grag_id}]" if grag_id else ""
-    logger.info(f"{prefix} 📍 步骤 {step_num}/{total_steps}: {description}")
+    logger.info("%s 📍 步骤 %s/%s: %s", prefix, step_num, total_steps, description)
 
 
 def get_neo4j_connector(grag_id: str) -> Neo4jConnector:
@@ -484,48 +711,159 @@ def get_neo4j_connector(grag_id: str) -> Neo4jConnector:
     # 使用 grag_id 作为连接池的键
     cache_key = f"connector_{grag_id}"
 
-    if cache_key in db_connections:
-        return db_connections[cache_key]
+    connector = db_connections.get(cache_key)
+    if connector is not None:
+        return connector
 
     try:
         connector = Neo4jConnector(
-            uri=DEFAULT_NEO4J_CONFIG["uri"],
-            username=DEFAULT_NEO4J_CONFIG["username"],
-            password=DEFAULT_NEO4J_CONFIG["password"],
-            grag_id=grag_id  # 传入 grag_id
+            grag_id=grag_id,  # 传入 grag_id
+            **DEFAULT_NEO4J_CONFIG
         )
-        db_connections[cache_key] = connector
-        logger.info(f"为图谱 '{grag_id}' 创建新连接")
-        return connector
     except Exception as e:
-        logger.error(f"创建数据库连接失败: {e}")
+        logger.error("创建数据库连接失败: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"无法连接到数据库 '{grag_id}': {str(e)}"
         )
 
+    # 建立连接在锁外进行;并发创建时只保留先登记的连接,关闭多余的一个
+    with _db_connections_lock:
+        existing = db_connections.setdefault(cache_key, connector)
+    if existing is not connector:
+        connector.close()
+        return existing
+    logger.info("为图谱 '%s' 创建新连接", grag_id)
+    return connector
+
+
+# GraphRAG输出清理用的正则
+_ANSI_RE = re.compile(r'(\x1B\[[0-9;]*m|\[[0-9;]*m)')
+_DATA_RE = re.compile(r'\[Data: [^\]]+\]')
+_BLANKLINES_RE = re.compile(r'\n\s*\n')
+
 
 def clean_graphrag_output(raw_text: str) -> str:
     """清理GraphRAG的原始输出"""
-    # 去除ANSI转义序列
-    ansi_escape = re.compile(r'(\x1B\[[0-9;]*m|\[[0-9;]*m)')
-    text = ansi_escape.sub('', raw_text)
+    # 去除ANSI转义序列(两种形式都以 '[' 开头,不含 '[' 时无需进入正则)
+    text = _ANSI_RE.sub('', raw_text) if '[' in raw_text else raw_text
 
     # 去除引用标记
-    text = re.sub(r'\[Data: [^\]]+\]', '', text)
+    text = _DATA_RE.sub('', text)
 
     # 清理空白
     text = text.strip()
-    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = _BLANKLINES_RE.sub('\n\n', text)
 
     return text
 
 
+# ============================================================
+# 辅助函数：查询公共逻辑
+# ============================================================
+
+async def run_blocking_query(func, *args, **kwargs):
+    """在线程中执行阻塞的查询调用，避免阻塞事件循环，并限制并发数"""
+    async with query_semaphore:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def extract_user_question(messages: Optional[List[MessageItem]]) -> Optional[str]:
+    """从消息列表中取最后一条 user 消息作为问题"""
+    for message in reversed(messages or []):
+        if message.role == "user":
+            return message.content
+    return None
+
+
+def build_tog_reasoning(grag_id: str, max_depth: Optional[int], max_width: Optional[int]) -> ToGReasoning:
+    """
+    创建绑定指定图谱的 ToG 推理引擎
+
+    Args:
+        grag_id: 图谱ID
+        max_depth: 最大探索深度
+        max_width: beam宽度
+
+    Returns:
+        ToGReasoning 实例
+    """
+    return ToGReasoning(
+        neo4j_connector=get_neo4j_connector(grag_id),
+        llm_model="qwen3:8b",
+        api_key="",
+        beam_width=max_width or 3,
+        max_depth=max_depth or 10,
+        retriever_path=os.path.join(RETRIEVER_PATH_BASE, grag_id, ".retrive"),
+        entity_linking_threshold=ENTITY_LINKING_THRESHOLD,
+        aux_llm_model=TOG_AUX_LLM_MODEL
+    )
+
+
+def run_graphrag_query(grag_id: str, method: str, question: str) -> tuple[bool, str, str]:
+    """
+    执行 GraphRAG 命令行查询
+
+    Args:
+        grag_id: 图谱ID
+        method: 查询方法 (local/global)
+        question: 用户问题
+
+    Returns:
+        (success, stdout, stderr)
+    """
+    user_path = os.path.join(GRAPHRAG_ROOT, grag_id)
+    query_command = (
+        f'python -m graphrag query '
+        f'--root {user_path} '
+        f'--method {method} '
+        f'--query "{question}"'
+    )
+    return run_command_with_progress(query_command, f"GraphRAG {method} 查询", grag_id)
+
+
 # ============================================================
 # 辅助函数：使用大模型生成整合答案
 # ============================================================
 
-async def generate_integrated_answer(neo4j_connector: Neo4jConnector, prompt: str) -> str:
+def select_answer_without_llm(tog_answer: str, graphrag_answer: str) -> Optional[str]:
+    """
+    判断混合查询是否可以跳过大模型整合
+
+    Args:
+        tog_answer: ToG 答案（推理失败时为空串）
+        graphrag_answer: GraphRAG 答案
+
+    Returns:
+        可直接采用的答案；需要大模型整合时返回 None
+    """
+    if not tog_answer:
+        return graphrag_answer
+    if not graphrag_answer:
+        return tog_answer
+
+    # quick_ratio 是 ratio 的上界,先用它排除明显不同的答案
+    matcher = SequenceMatcher(None, tog_answer, graphrag_answer)
+    if matcher.quick_ratio() > INTEGRATION_SIMILARITY_THRESHOLD and matcher.ratio() > INTEGRATION_SIMILARITY_THRESHOLD:
+        return tog_answer if len(tog_answer) >= len(graphrag_answer) else graphrag_answer
+    return None
+
+
+def get_llm_http_client() -> httpx.AsyncClient:
+    """获取调用大模型HTTP接口的共享客户端"""
+    global _llm_http_client
+    if _llm_http_client is None or _llm_http_client.is_closed:
+        _llm_http_client = httpx.AsyncClient(
+            timeout=120.0,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS
+            )
+        )
+    return _llm_http_client
+
+
+async def generate_integrated_answer(neo4j_connector: Optional[Neo4jConnector], prompt: str) -> str:
     """
     使用大模型生成整合答案
 
@@ -535,8 +873,6 @@ async def generate_integrated_answer(neo4j_connector: Neo4jConnector, prompt: st
     Returns:
         整合后的答案
     """
-    import httpx
-
     # 从环境变量或配置中获取LLM API配置
     # 假设使用与ToG相同的LLM配置
     llm_api_url = os.getenv("LLM_API_URL", "http://localhost:11434/api/generate")
@@ -554,18 +890,21 @@ async def generate_integrated_answer(neo4j_connector: Neo4jConnector, prompt: st
             }
         }
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(llm_api_url, json=payload)
-            response.raise_for_status()
-            result = response.json()
+        response = await get_llm_http_client().post(
+            llm_api_url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
 
-            # 根据API响应格式提取答案
-            if isinstance(result, dict):
-                answer = result.get("response", "")
-            else:
-                answer = str(result)
+        # 根据API响应格式提取答案
+        if isinstance(result, dict):
+            answer = result.get("response", "")
+        else:
+            answer = str(result)
 
-            return answer.strip()
+        return answer.strip()
 
     except httpx.TimeoutException:
         raise Exception("大模型调用超时")
@@ -587,6 +926,23 @@ async def generate_integrated_answer(neo4j_connector: Neo4jConnector, prompt: st
 # CORS跨域测试接口
 # ============================================================
 
+@app.on_event("startup")
+async def configure_default_executor():
+    """为阻塞调用配置有界的默认线程池"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_POOL_WORKERS, thread_name_prefix="blocking")
+    )
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """服务关闭时释放共享HTTP客户端"""
+    for client in (_llm_http_client, _callback_client):
+        if client is not None:
+            await client.aclose()
+    await close_llm_client()
+
+
 @app.get("/CORS_test", response_model=R)
 async def index():
     """简单的测试接口，用于验证跨域(CORS)配置是否生效"""
@@ -604,26 +960,14 @@ async def query_with_tog(request: ToGQueryRequest):
     """使用ToG (Think-on-Graph) 方法查询知识图谱"""
     try:
         logger.info("=" * 60)
-        logger.info(f"[{request.grag_id}] 🔍 收到ToG查询请求")
+        logger.info("[%s] 🔍 收到ToG查询请求", request.grag_id)
 
         # 1. 解析 Message
-        question = None
-        conversation_history = []
-
-        if request.messages and len(request.messages) > 0:
-            conversation_history = [
-                {"role": msg.role, "content": msg.content}
-                for msg in request.messages
-            ]
-
-            for message in reversed(request.messages):
-                if message.role == "user":
-                    question = message.content
-                    break
+        question = extract_user_question(request.messages)
 
         if not question:
             error_msg = "未找到有效的用户问题"
-            logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
             # ✅ 使用 R.error()
             return R.error(
                 message=error_msg,
@@ -631,38 +975,31 @@ async def query_with_tog(request: ToGQueryRequest):
                 code="400"
             )
 
-        logger.info(f"[{request.grag_id}] 💬 问题: {question}")
+        logger.info("[%s] 💬 问题: %s", request.grag_id, question)
 
         # 2. 获取数据库连接（带 grag_id）
         log_step(1, 3, "连接数据库", request.grag_id)
-        neo4j_connector = get_neo4j_connector(request.grag_id)
-        logger.info(f"[{request.grag_id}] ✅ 数据库连接成功")
+        get_neo4j_connector(request.grag_id)
+        logger.info("[%s] ✅ 数据库连接成功", request.grag_id)
 
         # 3. 创建 ToG 推理引擎
         log_step(2, 3, "初始化ToG推理引擎", request.grag_id)
-
-        dynamic_retriever_path = os.path.join(RETRIEVER_PATH_BASE, request.grag_id, ".retrive")
-        tog_reasoning = ToGReasoning(
-            neo4j_connector=neo4j_connector,
-            llm_model="qwen3:8b",
-            api_key="",
-            beam_width=request.max_width or 3,
-            max_depth=request.max_depth or 10,
-            retriever_path=dynamic_retriever_path,
-            entity_linking_threshold=ENTITY_LINKING_THRESHOLD
+        tog_reasoning = await run_blocking_query(
+            build_tog_reasoning, request.grag_id, request.max_depth, request.max_width
         )
-        logger.info(f"[{request.grag_id}] ✅ ToG引擎初始化完成")
+        logger.info("[%s] ✅ ToG引擎初始化完成", request.grag_id)
 
         # 4. 执行ToG推理
         log_step(3, 3, "执行ToG推理", request.grag_id)
-        result = tog_reasoning.reason(
-            question=question,
-            max_depth=request.max_depth or 10,
-            max_width=request.max_width or 3
-        )
+        async with query_semaphore:
+            result = await tog_reasoning.areason(
+                question=question,
+                max_depth=request.max_depth or 10,
+                max_width=request.max_width or 3
+            )
 
-        logger.info(f"[{request.grag_id}] ✅ 查询完成，耗时: {result.get('execution_time', 0):.2f}秒")
-        logger.info(f"[{request.grag_id}] 📄 答案长度: {len(result.get('answer', ''))} 字符")
+        logger.info("[%s] ✅ 查询完成，耗时: %.2f秒", request.grag_id, result.get('execution_time', 0))
+        logger.info("[%s] 📄 答案长度: %s 字符", request.grag_id, len(result.get('answer', '')))
         logger.info("=" * 60)
 
         # ✅ 使用 R.ok() 封装结果
@@ -679,7 +1016,7 @@ async def query_with_tog(request: ToGQueryRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"[{request.grag_id}] ❌ 查询处理失败: {e}", exc_info=True)
+        logger.error("[%s] ❌ 查询处理失败: %s", request.grag_id, e, exc_info=True)
         # ✅ 使用 R.error()
         return R.error(
             message="查询处理失败",
@@ -700,61 +1037,40 @@ async def graphrag_query(request: GraphRAGQueryRequest):
 
     try:
         logger.info("=" * 60)
-        logger.info(f"[{request.grag_id}] 🔍 收到GraphRAG查询请求")
+        logger.info("[%s] 🔍 收到GraphRAG查询请求", request.grag_id)
 
         # 1. 解析 messages
-        question = None
-        conversation_history = []
-
-        if request.messages and len(request.messages) > 0:
-            conversation_history = [
-                {"role": msg.role, "content": msg.content}
-                for msg in request.messages
-            ]
-
-            for message in reversed(request.messages):
-                if message.role == "user":
-                    question = message.content
-                    break
+        question = extract_user_question(request.messages)
 
         if not question:
             error_msg = "未找到有效的用户问题"
-            logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
             return R.error(
                 message=error_msg,
                 error_detail="messages 参数中没有 role 为 user 的消息",
                 code="400"
             )
 
-        logger.info(f"[{request.grag_id}] 💬 问题: {question}")
-        logger.info(f"[{request.grag_id}] 🔧 方法: {request.method}")
+        logger.info("[%s] 💬 问题: %s", request.grag_id, question)
+        logger.info("[%s] 🔧 方法: %s", request.grag_id, request.method)
 
         # 2. 检查用户目录
         log_step(1, 2, "检查知识图谱目录", request.grag_id)
         user_path = os.path.join(GRAPHRAG_ROOT, request.grag_id)
         if not os.path.exists(user_path):
             error_msg = f"目录 {request.grag_id} 不存在，请先创建知识图谱"
-            logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
             return R.not_found(
                 message=error_msg,
                 data={"grag_id": request.grag_id}
             )
 
-        logger.info(f"[{request.grag_id}] ✅ 知识图谱目录存在")
+        logger.info("[%s] ✅ 知识图谱目录存在", request.grag_id)
 
         # 3. 执行查询
         log_step(2, 2, "执行GraphRAG查询", request.grag_id)
-        query_command = (
-            f'python -m graphrag query '
-            f'--root {user_path} '
-            f'--method {request.method} '
-            f'--query "{question}"'
-        )
-
-        success, stdout, stderr = run_command_with_progress(
-            query_command,
-            f"GraphRAG {request.method} 查询",
-            request.grag_id
+        success, stdout, stderr = await run_blocking_query(
+            run_graphrag_query, request.grag_id, request.method, question
         )
 
         execution_time = time.time() - start_time
@@ -762,8 +1078,8 @@ async def graphrag_query(request: GraphRAGQueryRequest):
         if success:
             result = stdout.strip()
 
-            logger.info(f"[{request.grag_id}] ✅ 查询成功，耗时: {execution_time:.2f}秒")
-            logger.info(f"[{request.grag_id}] 📄 答案长度: {len(result)} 字符")
+            logger.info("[%s] ✅ 查询成功，耗时: %.2f秒", request.grag_id, execution_time)
+            logger.info("[%s] 📄 答案长度: %s 字符", request.grag_id, len(result))
             logger.info("=" * 60)
 
             # ✅ 使用 R.ok()
@@ -778,7 +1094,7 @@ async def graphrag_query(request: GraphRAGQueryRequest):
             )
         else:
             error_msg = stderr[:500] if stderr else "未知错误"
-            logger.error(f"[{request.grag_id}] ❌ 查询失败: {error_msg}")
+            logger.error("[%s] ❌ 查询失败: %s", request.grag_id, error_msg)
             logger.info("=" * 60)
 
             # ✅ 使用 R.fail()
@@ -791,7 +1107,7 @@ async def graphrag_query(request: GraphRAGQueryRequest):
     except subprocess.TimeoutExpired:
         execution_time = time.time() - start_time
         error_msg = "查询执行超时(超过5分钟)"
-        logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+        logger.error("[%s] ❌ %s", request.grag_id, error_msg)
         logger.info("=" * 60)
 
         # ✅ 使用 R.fail()
@@ -803,7 +1119,7 @@ async def graphrag_query(request: GraphRAGQueryRequest):
 
     except Exception as e:
         execution_time = time.time() - start_time
-        logger.error(f"[{request.grag_id}] ❌ 查询异常: {e}", exc_info=True)
+        logger.error("[%s] ❌ 查询异常: %s", request.grag_id, e, exc_info=True)
         logger.info("=" * 60)
 
         # ✅ 使用 R.error()
@@ -829,144 +1145,132 @@ async def query_with_tog_graphrag(request: ToGGraphRAGQueryRequest):
 
     try:
         logger.info("=" * 60)
-        logger.info(f"[{request.grag_id}] 🔍 收到ToG+GraphRAG混合查询请求")
+        logger.info("[%s] 🔍 收到ToG+GraphRAG混合查询请求", request.grag_id)
 
         # 1. 解析 Message
-        question = None
-        if request.messages and len(request.messages) > 0:
-            for message in reversed(request.messages):
-                if message.role == "user":
-                    question = message.content
-                    break
+        question = extract_user_question(request.messages)
 
         if not question:
             error_msg = "未找到有效的用户问题"
-            logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
             return R.error(
                 message=error_msg,
                 error_detail="messages 参数中没有 role 为 user 的消息",
                 code="400"
             )
 
-        logger.info(f"[{request.grag_id}] 💬 问题: {question}")
+        logger.info("[%s] 💬 问题: %s", request.grag_id, question)
 
-        # 2. 执行 ToG 查询
-        log_step(1, 4, "执行ToG查询", request.grag_id)
-        try:
-            neo4j_connector = get_neo4j_connector(request.grag_id)
-            dynamic_retriever_path = os.path.join(RETRIEVER_PATH_BASE, request.grag_id, ".retrive")
-
-            tog_reasoning = ToGReasoning(
-                neo4j_connector=neo4j_connector,
-                llm_model="qwen3:8b",
-                api_key="",
-                beam_width=request.max_width or 3,
-                max_depth=request.max_depth or 10,
-                retriever_path=dynamic_retriever_path,
-                entity_linking_threshold=ENTITY_LINKING_THRESHOLD
+        user_path = os.path.join(GRAPHRAG_ROOT, request.grag_id)
+        if not os.path.exists(user_path):
+            error_msg = f"目录 {request.grag_id} 不存在，请先创建知识图谱"
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
+            return R.not_found(
+                message=error_msg,
+                data={"grag_id": request.grag_id}
             )
 
-            tog_result = tog_reasoning.reason(
-                question=question,
-                max_depth=request.max_depth or 10,
-                max_width=request.max_width or 3
+        async def run_tog():
+            tog_reasoning = await run_blocking_query(
+                build_tog_reasoning, request.grag_id, request.max_depth, request.max_width
             )
-
-            tog_answer = tog_result.get("answer", "")
-            tog_success = tog_result.get("success", False)
-            logger.info(f"[{request.grag_id}] ✅ ToG查询完成，答案长度: {len(tog_answer)} 字符")
-
-        except Exception as e:
-            logger.error(f"[{request.grag_id}] ⚠️ ToG查询失败: {e}")
-            tog_answer = ""
-            tog_success = False
-
-        # 3. 执行 GraphRAG 查询
-        log_step(2, 4, "执行GraphRAG查询", request.grag_id)
-        try:
-            user_path = os.path.join(GRAPHRAG_ROOT, request.grag_id)
-            if not os.path.exists(user_path):
-                error_msg = f"目录 {request.grag_id} 不存在，请先创建知识图谱"
-                logger.error(f"[{request.grag_id}] ❌ {error_msg}")
-                return R.not_found(
-                    message=error_msg,
-                    data={"grag_id": request.grag_id}
+            async with query_semaphore:
+                tog_result = await tog_reasoning.areason(
+                    question=question,
+                    max_depth=request.max_depth or 10,
+                    max_width=request.max_width or 3
                 )
+            return tog_reasoning, tog_result
 
-            query_command = (
-                f'python -m graphrag query '
-                f'--root {user_path} '
-                f'--method {request.method} '
-                f'--query "{question}"'
-            )
+        # 2-3. 两种查询互不依赖,并行执行
+        log_step(1, 4, "执行ToG查询", request.grag_id)
+        log_step(2, 4, "执行GraphRAG查询", request.grag_id)
+        tog_outcome, graphrag_outcome = await asyncio.gather(
+            run_tog(),
+            run_blocking_query(run_graphrag_query, request.grag_id, request.method, question),
+            return_exceptions=True
+        )
 
-            success, stdout, stderr = run_command_with_progress(
-                query_command,
-                f"GraphRAG {request.method} 查询",
-                request.grag_id
-            )
+        embed_fn = None
+        neo4j_connector = None
+        if isinstance(tog_outcome, Exception):
+            logger.error("[%s] ⚠️ ToG查询失败: %s", request.grag_id, tog_outcome)
+            tog_answer = ""
+        else:
+            tog_reasoning, tog_result = tog_outcome
+            neo4j_connector = tog_reasoning.neo4j
+            if tog_reasoning.retriever:
+                embed_fn = tog_reasoning.retriever.embed_query
+            if tog_result.get("success", False):
+                tog_answer = tog_result.get("answer", "")
+                logger.info("[%s] ✅ ToG查询完成，答案长度: %s 字符", request.grag_id, len(tog_answer))
+            else:
+                # 推理失败时 answer 只是提示信息，不能作为答案返回或参与整合
+                tog_answer = ""
+                logger.warning("[%s] ⚠️ ToG未得到有效答案: %s", request.grag_id, tog_result.get("answer"))
 
+        if isinstance(graphrag_outcome, Exception):
+            logger.error("[%s] ⚠️ GraphRAG查询异常: %s", request.grag_id, graphrag_outcome)
+            graphrag_answer = ""
+        else:
+            success, stdout, stderr = graphrag_outcome
             if success:
                 graphrag_answer = stdout.strip()
-                logger.info(f"[{request.grag_id}] ✅ GraphRAG查询完成，答案长度: {len(graphrag_answer)} 字符")
+                logger.info("[%s] ✅ GraphRAG查询完成，答案长度: %s 字符", request.grag_id, len(graphrag_answer))
             else:
                 graphrag_answer = ""
-                logger.warning(f"[{request.grag_id}] ⚠️ GraphRAG查询失败")
-
-        except Exception as e:
-            logger.error(f"[{request.grag_id}] ⚠️ GraphRAG查询异常: {e}")
-            graphrag_answer = ""
+                logger.warning("[%s] ⚠️ GraphRAG查询失败", request.grag_id)
 
         # 4. 使用大模型整合答案
         log_step(3, 4, "整合两个答案", request.grag_id)
 
         if not tog_answer and not graphrag_answer:
             error_msg = "两种查询方法都未返回有效答案"
-            logger.error(f"[{request.grag_id}] ❌ {error_msg}")
+            logger.error("[%s] ❌ %s", request.grag_id, error_msg)
             return R.fail(
                 message=error_msg,
                 code="500"
             )
 
-        # 准备整合提示词
-        integration_prompt = f"""你是一个知识图谱查询助手。我使用两种不同的方法查询了同一个问题，现在需要你整合两个答案，给出最准确、最全面的回答。
-
-**问题：** {question}
-
-**方法1 - ToG（思维图谱）的答案：**
-{tog_answer if tog_answer else "(未获取到答案)"}
-
-**方法2 - GraphRAG的答案：**
-{graphrag_answer if graphrag_answer else "(未获取到答案)"}
-
-请综合以上两个答案，给出一个最终答案。要求：
-1. 综合两个答案的优点和补充信息
-2. 避免重复
-3. 确保回答的准确性和完整性
-4. 如果两个答案有冲突，说明你的判断依据
-5. 用清晰、结构化的方式(1、2、3...)呈现答案
-
-最终答案："""
-
-        # 5. 调用大模型生成整合答案
-        log_step(4, 4, "使用大模型生成最终答案", request.grag_id)
-        try:
-            # 使用 ToG 推理引擎中的 LLM 生成整合答案
-            final_answer = await generate_integrated_answer(
-                neo4j_connector=neo4j_connector,
-                prompt=integration_prompt
+        # 长答案的相似度比较是纯CPU计算,放到线程中避免阻塞事件循环
+        direct_answer = await asyncio.to_thread(select_answer_without_llm, tog_answer, graphrag_answer)
+        if direct_answer is not None:
+            # 一侧无有效答案或两者基本一致,无需调用大模型整合
+            final_answer = direct_answer
+            logger.info("[%s] ✅ 无需整合，直接采用已有答案", request.grag_id)
+        else:
+            # 准备整合提示词
+            integration_prompt = INTEGRATION_PROMPT_TEMPLATE.format(
+                question=question,
+                tog_answer=tog_answer or "(未获取到答案)",
+                graphrag_answer=graphrag_answer or "(未获取到答案)"
             )
-            logger.info(f"[{request.grag_id}] ✅ 整合答案生成完成，长度: {len(final_answer)} 字符")
 
-        except Exception as e:
-            logger.error(f"[{request.grag_id}] ❌ 整合答案生成失败: {e}")
-            # 如果大模型整合失败，返回较长的那个原始答案
-            final_answer = tog_answer if len(tog_answer) > len(graphrag_answer) else graphrag_answer
-            logger.warning(f"[{request.grag_id}] ⚠️ 使用原始答案替代整合答案")
+            # 5. 调用大模型生成整合答案
+            log_step(4, 4, "使用大模型生成最终答案", request.grag_id)
+            context_key = make_cache_key("integration", request.grag_id, tog_answer, graphrag_answer)
+            try:
+                final_answer = await asyncio.to_thread(integration_cache.get, context_key, question, embed_fn)
+                if final_answer is not None:
+                    logger.info("[%s] ✅ 整合答案命中缓存", request.grag_id)
+                else:
+                    # 使用 ToG 推理引擎中的 LLM 生成整合答案
+                    final_answer = await generate_integrated_answer(
+                        neo4j_connector=neo4j_connector,
+                        prompt=integration_prompt
+                    )
+                    await asyncio.to_thread(integration_cache.set, context_key, question, final_answer, embed_fn)
+                    logger.info("[%s] ✅ 整合答案生成完成，长度: %s 字符", request.grag_id, len(final_answer))
+
+            except Exception as e:
+                logger.error("[%s] ❌ 整合答案生成失败: %s", request.grag_id, e)
+                # 如果大模型整合失败，返回较长的那个原始答案
+                final_answer = tog_answer if len(tog_answer) > len(graphrag_answer) else graphrag_answer
+                logger.warning("[%s] ⚠️ 使用原始答案替代整合答案", request.grag_id)
 
         execution_time = time.time() - start_time
 
-        logger.info(f"[{request.grag_id}] ✅ 混合查询完成，总耗时: {execution_time:.2f}秒")
+        logger.info("[%s] ✅ 混合查询完成，总耗时: %.2f秒", request.grag_id, execution_time)
         logger.info("=" * 60)
 
         # ✅ 使用 R.ok()
@@ -984,7 +1288,7 @@ async def query_with_tog_graphrag(request: ToGGraphRAGQueryRequest):
 
     except Exception as e:
         execution_time = time.time() - start_time
-        logger.error(f"[{request.grag_id}] ❌ 混合查询处理失败: {e}", exc_info=True)
+        logger.error("[%s] ❌ 混合查询处理失败: %s", request.grag_id, e, exc_info=True)
 
         # ✅ 使用 R.error()
         return R.error(
@@ -1010,13 +1314,13 @@ async def create_graph(
     """
     try:
         logger.info("=" * 60)
-        logger.info(f"[{grag_id}] 📊 接收到图谱创建请求")
+        logger.info("[%s] 📊 接收到图谱创建请求", grag_id)
 
         # 步骤1: 创建用户目录
         user_path = os.path.join(GRAPHRAG_ROOT, grag_id)
         input_dir = os.path.join(user_path, "input")
         os.makedirs(input_dir, exist_ok=True)
-        logger.info(f"[{grag_id}] ✅ 目录创建完成: {input_dir}")
+        logger.info("[%s] ✅ 目录创建完成: %s", grag_id, input_dir)
 
         # 步骤2: 保存上传的文件
         file_path = os.path.join(input_dir, file.filename)
@@ -1024,7 +1328,7 @@ async def create_graph(
             shutil.copyfileobj(file.file, buffer)
 
         file_size = os.path.getsize(file_path)
-        logger.info(f"[{grag_id}] ✅ 文件已保存: {file.filename} ({file_size / 1024:.2f} KB)")
+        logger.info("[%s] ✅ 文件已保存: %s (%.2f KB)", grag_id, file.filename, file_size / 1024)
 
         # 添加后台任务
         background_tasks.add_task(
@@ -1036,7 +1340,7 @@ async def create_graph(
             input_dir=input_dir
         )
 
-        logger.info(f"[{grag_id}] 📄 后台任务已启动")
+        logger.info("[%s] 📄 后台任务已启动", grag_id)
         logger.info("=" * 60)
 
         # ✅ 使用 R.ok() 立即返回
@@ -1051,7 +1355,7 @@ async def create_graph(
         )
 
     except Exception as e:
-        logger.error(f"[{grag_id if 'grag_id' in locals() else 'Unknown'}] ❌ 处理失败: {e}", exc_info=True)
+        logger.error("[%s] ❌ 处理失败: %s", grag_id if 'grag_id' in locals() else 'Unknown', e, exc_info=True)
 
         # ✅ 使用 R.error()
         return R.error(
@@ -1074,9 +1378,9 @@ if __name__ == "__main__":
 
     logger.info("=" * 60)
     logger.info("🚀 启动ToG Knowledge Graph API服务器")
-    logger.info(f"📍 地址: http://{server_host}:{server_port}")
-    logger.info(f"📚 文档: http://{server_host}:{server_port}/docs")
-    logger.info(f"🔗 Java回调地址: {JAVA_BACKEND_URL}{JAVA_CALLBACK_PATH}")
+    logger.info("📍 地址: http://%s:%s", server_host, server_port)
+    logger.info("📚 文档: http://%s:%s/docs", server_host, server_port)
+    logger.info("🔗 Java回调地址: %s%s", JAVA_BACKEND_URL, JAVA_CALLBACK_PATH)
     logger.info("=" * 60)
 
     uvicorn.run(
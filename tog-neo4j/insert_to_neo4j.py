@@ -3,7 +3,7 @@ Neo4j 导入工具
 支持多知识库隔离存储，通过 grag_id 区分
 """
 
-import json
+import orjson
 import os
 from neo4j import GraphDatabase
 from typing import List, Dict, Any
@@ -37,8 +37,8 @@ class Neo4jImporter:
         if not os.path.exists(json_file):
             raise FileNotFoundError(f"文件未找到: {json_file}")
 
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_file, 'rb') as f:
+            data = orjson.loads(f.read())
 
         print(f"[INFO] 加载数据文件: {json_file}")
         print(f"[INFO] 知识库ID: {data['metadata']['grag_id']}")
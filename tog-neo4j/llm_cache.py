@@ -0,0 +1,150 @@
+"""
+LLM 结果语义缓存模块
+精确命中：按 sha256(提示词模板 + 上下文 + 问题) 查找
+近似命中：同一上下文下，问题向量余弦相似度超过阈值即复用
+支持 TTL 过期与 LRU 淘汰
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+EmbedFn = Callable[[str], List[float]]
+
+
+def make_cache_key(*parts: str) -> str:
+    """将多个字符串片段拼接后计算 sha256 作为缓存键"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """两个向量的余弦相似度,任一为零向量时返回 0"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class SemanticCache:
+    """LLM 响应缓存 - 精确键 + 问题向量近似匹配"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.92):
+        """
+        初始化缓存
+
+        Args:
+            max_size: 最大缓存条目数，超过后按 LRU 淘汰
+            ttl: 条目存活时间(秒)
+            similarity_threshold: 近似命中的余弦相似度阈值
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, context_key: str, question: str, embed_fn: Optional[EmbedFn] = None) -> Optional[str]:
+        """
+        查找缓存
+
+        Args:
+            context_key: 上下文键（模板ID + 参与拼接的其他内容的哈希），近似匹配只在同一上下文内进行
+            question: 用户问题
+            embed_fn: 问题向量化函数，为 None 时只做精确匹配
+
+        Returns:
+            命中时返回缓存的响应，否则返回 None
+        """
+        exact_key = make_cache_key(context_key, question)
+        now = time.time()
+
+        # 过期条目只在被访问到时删除（以及写入超出容量时清理），读路径不做全量扫描
+        with self._lock:
+            entry = self._live_entry(exact_key, now)
+            if entry is not None:
+                self._entries.move_to_end(exact_key)
+                return entry["response"]
+
+            if embed_fn is None:
+                return None
+            candidates = [
+                (key, e) for key, e in self._entries.items()
+                if e["context_key"] == context_key and e["embedding"] is not None and e["expires_at"] > now
+            ]
+
+        if not candidates:
+            return None
+
+        try:
+            query_vec = embed_fn(question)
+        except Exception:
+            return None
+
+        best_key, best_score = None, self.similarity_threshold
+        for key, e in candidates:
+            score = cosine_similarity(query_vec, e["embedding"])
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+
+        with self._lock:
+            entry = self._live_entry(best_key, time.time())
+            if entry is None:
+                return None
+            self._entries.move_to_end(best_key)
+            return entry["response"]
+
+    def set(self, context_key: str, question: str, response: str, embed_fn: Optional[EmbedFn] = None):
+        """
+        写入缓存
+
+        Args:
+            context_key: 上下文键
+            question: 用户问题
+            response: LLM 响应
+            embed_fn: 问题向量化函数，提供时同时保存问题向量用于近似匹配
+        """
+        if not response:
+            return
+
+        embedding = None
+        if embed_fn is not None:
+            try:
+                embedding = embed_fn(question)
+            except Exception:
+                embedding = None
+
+        exact_key = make_cache_key(context_key, question)
+        with self._lock:
+            self._entries[exact_key] = {
+                "context_key": context_key,
+                "embedding": embedding,
+                "response": response,
+                "expires_at": time.time() + self.ttl
+            }
+            self._entries.move_to_end(exact_key)
+            if len(self._entries) > self.max_size:
+                self._evict_expired(time.time())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def _live_entry(self, key: str, now: float) -> Optional[dict]:
+        """取出未过期的条目，已过期的顺带删除（调用方持有锁）"""
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires_at"] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _evict_expired(self, now: float):
+        expired = [key for key, e in self._entries.items() if e["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
@@ -12,7 +12,18 @@ logger = logging.getLogger(__name__)
 class Neo4jConnector:
     """Neo4j 数据库连接器 - 支持 grag_id 隔离"""
 
-    def __init__(self, uri: str, username: str, password: str, grag_id: Optional[str] = None):
+    def __init__(
+            self,
+            uri: str,
+            username: str,
+            password: str,
+            grag_id: Optional[str] = None,
+            database: Optional[str] = None,
+            max_connection_pool_size: int = 100,
+            connection_acquisition_timeout: float = 60.0,
+            max_connection_lifetime: float = 3600.0,
+            fetch_size: int = 1000
+    ):
         """
         初始化 Neo4j 连接
 
@@ -21,14 +32,28 @@ class Neo4jConnector:
             username: 用户名
             password: 密码
             grag_id: 图谱ID，用于数据隔离
+            database: 数据库名，指定后会话无需再解析 home database
+            max_connection_pool_size: 连接池最大连接数
+            connection_acquisition_timeout: 从连接池获取连接的超时时间(秒)
+            max_connection_lifetime: 连接最长存活时间(秒)
+            fetch_size: 每批拉取的记录数
         """
         try:
-            self.driver = GraphDatabase.driver(uri, auth=(username, password))
+            self.driver = GraphDatabase.driver(
+                uri,
+                auth=(username, password),
+                max_connection_pool_size=max_connection_pool_size,
+                connection_acquisition_timeout=connection_acquisition_timeout,
+                max_connection_lifetime=max_connection_lifetime,
+                keep_alive=True
+            )
             self.driver.verify_connectivity()
             self.grag_id = grag_id
-            logger.info(f"成功连接到 Neo4j 数据库 (grag_id: {grag_id})")
+            self.database = database
+            self.fetch_size = fetch_size
+            logger.info("成功连接到 Neo4j 数据库 (grag_id: %s)", grag_id)
         except Exception as e:
-            logger.error(f"连接 Neo4j 失败: {e}")
+            logger.error("连接 Neo4j 失败: %s", e)
             raise
 
     def close(self):
@@ -37,6 +62,10 @@ class Neo4jConnector:
             self.driver.close()
             logger.info("Neo4j 连接已关闭")
 
+    def session(self):
+        """创建带数据库名和批量拉取配置的会话"""
+        return self.driver.session(database=self.database, fetch_size=self.fetch_size)
+
     def execute_query(self, cypher_query: str, parameters: Dict = None) -> List[Dict]:
         """
         执行 Cypher 查询
@@ -49,13 +78,13 @@ class Neo4jConnector:
             查询结果列表
         """
         try:
-            with self.driver.session() as session:
+            with self.session() as session:
                 result = session.run(cypher_query, parameters or {})
                 return [record.data() for record in result]
         except Exception as e:
-            logger.error(f"Cypher查询失败: {e}")
-            logger.error(f"查询语句: {cypher_query}")
-            logger.error(f"参数: {parameters}")
+            logger.error("Cypher查询失败: %s", e)
+            logger.error("查询语句: %s", cypher_query)
+            logger.error("参数: %s", parameters)
             return []
 
     def _add_grag_filter(self, query: str, where_exists: bool = True) -> str:
@@ -203,6 +232,50 @@ class Neo4jConnector:
         params = self._get_params_with_grag_id({"entity_name": entity_name})
         return self.execute_query(query, params)
 
+    def get_relation_targets_batch(
+            self,
+            entity_names: List[str],
+            limit: int = 20,
+            relation_limit: int = 20
+    ) -> Dict[str, Dict[str, List[str]]]:
+        """
+        批量获取多个实体按关系分组的一跳目标实体（限制在当前 grag_id），分组与去重在数据库端完成
+
+        Args:
+            entity_names: 实体名称列表
+            limit: 每个(实体,关系)最多返回的目标实体数
+            relation_limit: 每个实体最多返回的关系类型数(目标实体多的关系优先)
+
+        Returns:
+            {实体名称: {关系类型: [目标实体名称]}}
+        """
+        targets_by_entity: Dict[str, Dict[str, List[str]]] = {name: {} for name in entity_names}
+        if not entity_names:
+            return targets_by_entity
+
+        query = """
+        UNWIND $entity_names AS entity_name
+        MATCH (n)-[r]-(m)
+        WHERE n.name = entity_name
+          AND n.grag_id = $grag_id
+          AND m.grag_id = $grag_id
+          AND r.grag_id = $grag_id
+          AND m.name IS NOT NULL
+        WITH entity_name, type(r) as relation, collect(DISTINCT m.name) as targets
+        ORDER BY size(targets) DESC, relation
+        WITH entity_name, collect({relation: relation, targets: targets[..$limit]})[..$relation_limit] as relations
+        UNWIND relations as rel
+        RETURN entity_name, rel.relation as relation, rel.targets as targets
+        """
+        params = self._get_params_with_grag_id({
+            "entity_names": list(targets_by_entity),
+            "limit": limit,
+            "relation_limit": relation_limit
+        })
+        for record in self.execute_query(query, params):
+            targets_by_entity[record["entity_name"]][record["relation"]] = record["targets"]
+        return targets_by_entity
+
     def get_relation_path(self, source: str, target: str, max_depth: int = 3) -> List[Dict]:
         """
         查找两个实体之间的关系路径（限制在当前 grag_id）
@@ -290,8 +363,8 @@ class Neo4jConnector:
             params = self._get_params_with_grag_id()
             return self.execute_query(filtered_query, params)
         except Exception as e:
-            logger.error(f"执行查询失败: {e}")
-            logger.error(f"查询语句: {cypher_query}")
+            logger.error("执行查询失败: %s", e)
+            logger.error("查询语句: %s", cypher_query)
             return []
 
     def search_operations_by_keyword(self, keyword: str) -> List[Dict]:
@@ -0,0 +1,135 @@
+"""ToG 推理、LLM缓存与服务端辅助函数中不依赖外部服务的纯逻辑测试"""
+import time
+
+from fastapi_server import _split_lines, select_answer_without_llm
+from llm_cache import SemanticCache
+from tog_reasoning import ToGReasoning, _parse_json_response, _strip_think
+
+
+def test_strip_think_removes_reasoning_block():
+    assert _strip_think("<think>先想一想</think>\nANSWER: 北京").strip() == "ANSWER: 北京"
+
+
+def test_strip_think_unfinished_block_is_empty():
+    assert _strip_think("<think>还没想完") == ""
+
+
+def test_parse_json_response_plain():
+    assert _parse_json_response('{"1": ["HAS_STEP"]}') == {"1": ["HAS_STEP"]}
+
+
+def test_parse_json_response_code_fence():
+    response = '结果如下:\n```json\n{"1": ["HAS_STEP"], "2": []}\n```'
+    assert _parse_json_response(response) == {"1": ["HAS_STEP"], "2": []}
+
+
+def test_parse_json_response_reasoning_model_output():
+    response = (
+        '<think>候选关系有 {"1": [...]} 这种格式,先看第1项…</think>\n'
+        '{"1": ["HAS_STEP"]}'
+    )
+    assert _parse_json_response(response) == {"1": ["HAS_STEP"]}
+
+
+def test_parse_json_response_invalid():
+    assert _parse_json_response("没有JSON") is None
+    assert _parse_json_response("") is None
+
+
+# ---------------- SemanticCache ----------------
+
+def _embed(text):
+    return [1.0, 0.0] if "北京" in text else [0.0, 1.0]
+
+
+def test_semantic_cache_exact_hit():
+    cache = SemanticCache(max_size=4, ttl=60)
+    cache.set("ctx", "问题", "答案")
+    assert cache.get("ctx", "问题") == "答案"
+    assert cache.get("other", "问题") is None
+
+
+def test_semantic_cache_near_hit_within_context():
+    cache = SemanticCache(max_size=4, ttl=60, similarity_threshold=0.9)
+    cache.set("ctx", "北京在哪里", "华北", embed_fn=_embed)
+    assert cache.get("ctx", "北京位于哪里", embed_fn=_embed) == "华北"
+    assert cache.get("ctx", "上海在哪里", embed_fn=_embed) is None
+    assert cache.get("other", "北京位于哪里", embed_fn=_embed) is None
+
+
+def test_semantic_cache_ttl_expiry():
+    cache = SemanticCache(max_size=4, ttl=0.01)
+    cache.set("ctx", "问题", "答案")
+    time.sleep(0.02)
+    assert cache.get("ctx", "问题") is None
+
+
+def test_semantic_cache_lru_eviction():
+    cache = SemanticCache(max_size=2, ttl=60)
+    cache.set("ctx", "a", "A")
+    cache.set("ctx", "b", "B")
+    assert cache.get("ctx", "a") == "A"
+    cache.set("ctx", "c", "C")
+    assert cache.get("ctx", "b") is None
+    assert cache.get("ctx", "a") == "A"
+    assert cache.get("ctx", "c") == "C"
+
+
+# ---------------- select_answer_without_llm ----------------
+
+def test_select_answer_one_side_empty():
+    assert select_answer_without_llm("", "GraphRAG答案") == "GraphRAG答案"
+    assert select_answer_without_llm("ToG答案", "") == "ToG答案"
+
+
+def test_select_answer_similar_answers_prefers_longer():
+    tog_answer = "GHOST镜像需要先挂载到服务器上再安装。"
+    graphrag_answer = "GHOST镜像需要先挂载到服务器上再安装"
+    assert select_answer_without_llm(tog_answer, graphrag_answer) == tog_answer
+
+
+def test_select_answer_different_answers_need_llm():
+    assert select_answer_without_llm("使用U盘启动安装", "通过网络PXE批量部署系统") is None
+
+
+# ---------------- _split_lines ----------------
+
+def test_split_lines_keeps_partial_line():
+    buffer = bytearray(b"first\nsecond\r\nthird")
+    assert _split_lines(buffer) == [b"first", b"second"]
+    assert buffer == bytearray(b"third")
+
+
+def test_split_lines_lone_cr_and_split_crlf():
+    buffer = bytearray(b"50%\r100%\r")
+    assert _split_lines(buffer) == [b"50%"]
+    # 末尾的 \r 留待与下一块开头的 \n 合并为一个换行
+    assert buffer == bytearray(b"100%\r")
+    buffer.extend(b"\ndone\n")
+    assert _split_lines(buffer) == [b"100%", b"done"]
+    assert buffer == bytearray()
+
+
+# ---------------- ToGReasoning._prune_paths ----------------
+
+def _step(source, relation, target):
+    return {"source": source, "relation": relation, "target": target}
+
+
+def _reasoning_without_retriever():
+    reasoning = ToGReasoning.__new__(ToGReasoning)
+    reasoning.retriever = None
+    return reasoning
+
+
+def test_prune_paths_removes_duplicates():
+    path = [_step("A", None, "A"), _step("A", "包含", "B")]
+    pruned = _reasoning_without_retriever()._prune_paths([path, list(path)], "A包含什么")
+    assert pruned == [path]
+
+
+def test_prune_paths_drops_cycles():
+    cycle = [_step("A", None, "A"), _step("A", "包含", "B"), _step("B", "属于", "A")]
+    forward = [_step("A", None, "A"), _step("A", "包含", "B"), _step("B", "需要", "C")]
+    pruned = _reasoning_without_retriever()._prune_paths([cycle, forward], "B需要什么")
+    assert pruned == [forward]
@@ -1,13 +1,198 @@
+import asyncio
+import re
 import time
 import logging
+import weakref
+from string import Formatter
 from typing import List, Dict, Any, Optional
+import httpx
 import ollama
+import orjson
 from neo4j_connector import Neo4jConnector
 from ywretriever import Retriever, entity_linking
+from llm_cache import SemanticCache, cosine_similarity, make_cache_key
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 充分性评估结果缓存（跨请求共享，ToGReasoning 按请求创建）
+evaluation_cache = SemanticCache(max_size=1024, ttl=3600.0, similarity_threshold=0.92)
+
+# 确定性(temperature=0)LLM调用结果缓存,相同问题重复推理时跳过实体抽取与关系/实体选择
+llm_response_cache = SemanticCache(max_size=1024, ttl=300.0)
+
+# 进程内共享的 Ollama 客户端,跨请求复用连接池与 keep-alive:{事件循环: (客户端, httpx 传输层)}。
+# 客户端绑定创建它的事件循环;连接池由自行创建的传输层持有,关闭客户端即关闭该传输层
+_llm_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+# 问题中直接匹配到的最长实体名至少占问题长度的该比例时,才跳过LLM实体抽取
+MENTION_MIN_COVERAGE = 0.3
+
+# 充分性评估提示词中最多携带的路径数
+MAX_EVALUATION_PATHS = 8
+
+# 每个(实体,关系)参与实体选择的最大候选目标数
+MAX_TARGET_CANDIDATES = 20
+
+# 批量选择提示词中每一项最多列出的候选数,同时也是每个实体参与关系选择的最大关系数
+MAX_BATCH_CANDIDATES = 20
+
+# 流式选择调用的可见输出(不含思考过程)超过该字符数即停止生成
+SELECTION_MAX_CHARS = 512
+
+# LLM 输出中的 ```json ... ``` 代码块
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+# 评估并作答提示词约定的输出格式:信息充足时 "ANSWER: <答案>",否则 "INSUFFICIENT"
+_ANSWER_RE = re.compile(r"ANSWER:\s*(.*)", re.IGNORECASE | re.DOTALL)
+_INSUFFICIENT_RE = re.compile(r"INSUFFICIENT", re.IGNORECASE)
+
+
+def _strip_think(text: str) -> str:
+    """去掉推理模型输出中的 <think>...</think> 思考过程,思考未结束时返回空串"""
+    if "<think>" not in text:
+        return text
+    _, sep, visible = text.partition("</think>")
+    return visible if sep else ""
+
+
+def _parse_json_response(response: str) -> Optional[Any]:
+    """
+    从LLM响应中解析JSON对象
+
+    Args:
+        response: LLM原始输出,可能带有思考过程、代码块或前后说明文字
+
+    Returns:
+        解析得到的对象,解析失败返回 None
+    """
+    # 思考过程中常出现 '{',不去掉会导致定位到错误的JSON起点
+    response = _strip_think(response)
+    if not response:
+        return None
+    fence = _JSON_FENCE_RE.search(response)
+    text = fence.group(1) if fence else response
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        return orjson.loads(text[start:end + 1])
+    except orjson.JSONDecodeError:
+        return None
+
+
+def get_llm_client() -> ollama.AsyncClient:
+    """获取当前事件循环上共享的 Ollama 客户端,首次使用时创建"""
+    loop = asyncio.get_running_loop()
+    entry = _llm_clients.get(loop)
+    if entry is None:
+        transport = httpx.AsyncHTTPTransport()
+        # ollama.AsyncClient 把额外参数透传给内部的 httpx.AsyncClient
+        entry = _llm_clients[loop] = (ollama.AsyncClient(transport=transport), transport)
+    return entry[0]
+
+
+async def close_llm_client():
+    """关闭当前事件循环上共享的 Ollama 客户端,须在该事件循环结束前调用"""
+    entry = _llm_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].aclose()
+
+
+class PromptTemplate:
+    """预解析的提示词模板：占位符只解析一次，渲染时直接拼接"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts = list(Formatter().parse(template))
+
+    def format(self, **kwargs) -> str:
+        pieces = []
+        for literal, field, spec, conversion in self._parts:
+            pieces.append(literal)
+            if field is None:
+                continue
+            value = kwargs[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            pieces.append(format(value, spec) if spec else str(value))
+        return "".join(pieces)
+
+
+# ToG 各阶段提示词模板
+_PROMPT_TEMPLATES = {
+    "entity_extraction": """Given the question: "{question}"
+Please extract all key entities mentioned in this question.
+Return only the entity names, separated by commas.
+Entities:""",
+
+    "relation_selection": """Given the question: "{question}"
+Current entities: {entities}
+Available relations: {relations}
+
+Please select the top {beam_width} most relevant relations that help answer the question.
+Return only the relation names, separated by commas.
+Selected relations:""",
+
+    "entity_selection": """Given the question: "{question}"
+Current relation: {relation}
+Available entities: {entities}
+
+Please select the top {beam_width} most relevant entities that help answer the question.
+Return only the entity names, separated by commas.
+Selected entities:""",
+
+    "relation_selection_batched": """Given the question: "{question}"
+For each numbered entity below, the available relations are listed after the colon:
+{items}
+
+For each entity, select the top {beam_width} most relevant relations that help answer the question.
+Return only a JSON object mapping each item number to a list of the selected relation names, e.g. {{"1": ["relation_a", "relation_b"]}}.
+JSON:""",
+
+    "entity_selection_batched": """Given the question: "{question}"
+For each numbered (entity, relation) pair below, the available target entities are listed after the colon:
+{items}
+
+For each pair, select the top {beam_width} most relevant target entities that help answer the question.
+Return only a JSON object mapping each item number to a list of the selected entity names, e.g. {{"1": ["entity_a", "entity_b"]}}.
+JSON:""",
+
+    "evaluate_and_answer": """Given the question: "{question}"
+Retrieved knowledge paths:
+{paths}
+
+If you can answer the question with sufficient confidence based on these paths and your knowledge, reply with "ANSWER:" followed by a clear answer.
+Requirements for the answer:
+1. Organize the answer into numbered points (1. 2. 3. ...)
+2. Each point should start on a new line
+3. Provide a concise and structured response
+
+Otherwise reply with only "INSUFFICIENT".
+Reply:""",
+
+    "answer_generation": """Based on the question and retrieved knowledge paths, please provide a clear answer.
+
+            Requirements:
+            1. Organize the answer into numbered points (1. 2. 3. ...)
+            2. Each point should start on a new line
+            3. Provide a concise and structured response
+
+            Question: {question}
+            Knowledge paths:
+            {paths}
+
+            Answer:"""
+}
+
+# 预解析的提示词模板,进程内所有推理实例共享
+PROMPTS: Dict[str, PromptTemplate] = {
+    name: PromptTemplate(template) for name, template in _PROMPT_TEMPLATES.items()
+}
+
+
 class ToGReasoning:
     """
     ToG (Think-on-Graph) 推理引擎
@@ -25,14 +210,22 @@ class ToGReasoning:
             beam_width: int = 3,
             max_depth: int = 10,
             retriever_path: str =None,
-            entity_linking_threshold: float = 15.0
+            entity_linking_threshold: float = 15.0,
+            llm_concurrency: int = 4,
+            aux_llm_model: Optional[str] = None
     ):
         self.neo4j = neo4j_connector
         self.llm_model = llm_model
+        # 实体抽取、关系/实体选择等短输出调用可使用更轻量的模型;评估并作答使用主模型
+        self.aux_llm_model = aux_llm_model or llm_model
         self.api_key = api_key
         self.beam_width = beam_width
         self.max_depth = max_depth
-        self.prompts = self._load_prompts()
+        # 单次推理内同时在途的LLM请求上限,应与 Ollama 服务端的 OLLAMA_NUM_PARALLEL 保持一致,
+        # 超出服务端并行度的请求只会在服务端排队
+        self.llm_concurrency = max(1, llm_concurrency)
+        self._llm_semaphore: Optional[asyncio.Semaphore] = None
+        self.prompts = PROMPTS
 
         # 初始化实体链接检索器
         try:
@@ -41,111 +234,206 @@ class ToGReasoning:
                 retriever_version=retriever_path
             )
             self.entity_linking_threshold = entity_linking_threshold
-            logger.info(f"实体链接检索器初始化成功: {retriever_path}")
+            logger.info("实体链接检索器初始化成功: %s", retriever_path)
         except Exception as e:
-            logger.warning(f"实体链接检索器初始化失败: {e}, 将使用原有的实体匹配方法")
+            logger.warning("实体链接检索器初始化失败: %s, 将使用原有的实体匹配方法", e)
             self.retriever = None
 
-    def _load_prompts(self) -> Dict[str, str]:
-        """加载提示词模板"""
-        return {
-            "entity_extraction": """Given the question: "{question}"
-Please extract all key entities mentioned in this question.
-Return only the entity names, separated by commas.
-Entities:""",
-
-            "relation_selection": """Given the question: "{question}"
-Current entities: {entities}
-Available relations: {relations}
+    async def _acall_llm(self, prompt: str, temperature: float = 0.0, model: Optional[str] = None) -> str:
+        """
+        异步调用LLM,默认使用主模型;并发数受 llm_concurrency 限制,temperature=0 的结果会被缓存
 
-Please select the top {beam_width} most relevant relations that help answer the question.
-Return only the relation names, separated by commas.
-Selected relations:""",
+        返回内容已去掉推理模型的 <think> 思考过程
+        """
+        model = model or self.llm_model
+        cache_key = make_cache_key("llm", model) if temperature == 0 else None
+        if cache_key:
+            cached = llm_response_cache.get(cache_key, prompt)
+            if cached is not None:
+                return cached
+
+        client = self._get_llm_client()
+        try:
+            async with self._llm_semaphore:
+                response = await client.chat(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    options={
+                        "temperature": temperature,
+                        "num_predict": 3000
+                    }
+                )
+            content = _strip_think(response['message']['content']).strip()
+        except Exception as e:
+            logger.error("LLM调用失败: %s", e)
+            return ""
 
-            "entity_selection": """Given the question: "{question}"
-Current relation: {relation}
-Available entities: {entities}
+        if cache_key:
+            llm_response_cache.set(cache_key, prompt, content)
+        return content
 
-Please select the top {beam_width} most relevant entities that help answer the question.
-Return only the entity names, separated by commas.
-Selected entities:""",
+    async def _acall_llm_list(self, prompt: str, max_items: int, model: Optional[str] = None) -> List[str]:
+        """
+        流式调用LLM获取逗号分隔的名称列表,凑够 max_items 项后立即停止生成
 
-            "reasoning_evaluation": """Given the question: "{question}"
-Retrieved knowledge paths:
-{paths}
+        Args:
+            prompt: 要求返回逗号分隔名称的提示词
+            max_items: 需要的名称数
+            model: 使用的模型,默认主模型
 
-Can you answer the question with sufficient confidence based on these paths and your knowledge?
-Answer with only "Yes" or "No".
-Answer:""",
+        Returns:
+            名称列表(最多 max_items 项)
+        """
+        model = model or self.llm_model
+        cache_key = make_cache_key("llm_list", model, str(max_items))
+        content = llm_response_cache.get(cache_key, prompt)
 
-            "answer_generation": """Based on the question and retrieved knowledge paths, please provide a clear answer.
+        if content is None:
+            client = self._get_llm_client()
+            pieces = []
+            try:
+                async with self._llm_semaphore:
+                    stream = await client.chat(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        options={
+                            "temperature": 0.0,
+                            "num_predict": 3000
+                        },
+                        stream=True
+                    )
+                    async for chunk in stream:
+                        pieces.append(chunk['message']['content'])
+                        # 第 max_items 个逗号出现时前 max_items 项已完整
+                        visible = _strip_think("".join(pieces))
+                        if visible.count(",") >= max_items or len(visible) > SELECTION_MAX_CHARS:
+                            break
+            except Exception as e:
+                logger.error("LLM调用失败: %s", e)
+                return []
+            content = _strip_think("".join(pieces)).strip()
+            llm_response_cache.set(cache_key, prompt, content)
+
+        return [s.strip() for s in content.split(",") if s.strip()][:max_items]
+
+    def _get_llm_client(self) -> ollama.AsyncClient:
+        """获取共享的LLM客户端,并确保本次推理的并发信号量已创建"""
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(self.llm_concurrency)
+        return get_llm_client()
+
+    @staticmethod
+    def clear_cache():
+        """清空LLM响应与充分性评估缓存,图谱数据变更后调用"""
+        llm_response_cache.clear()
+        evaluation_cache.clear()
+
+    async def _select_candidates(
+            self,
+            question: str,
+            items: List[tuple],
+            single_prompts: List[str],
+            batched_template: str
+    ) -> List[List[str]]:
+        """
+        让LLM从多组候选中分别挑选最相关的若干项
 
-            Requirements:
-            1. Organize the answer into numbered points (1. 2. 3. ...)
-            2. Each point should start on a new line
-            3. Provide a concise and structured response
+        多组候选合并为一个批量提示词只调用一次LLM;批量结果解析失败或缺项时,
+        对缺失的组回退到逐组提示词并发流式调用
 
-            Question: {question}
-            Knowledge paths:
-            {paths}
+        Args:
+            question: 用户问题
+            items: [(组标签, 候选列表)]
+            single_prompts: 与 items 一一对应的逐组提示词
+            batched_template: 批量提示词模板名
 
-            Answer:"""
-        }
+        Returns:
+            与 items 顺序一致的选择结果列表
+        """
+        selections: List[Optional[List[str]]] = [None] * len(items)
 
-    def _call_llm(self, prompt: str, temperature: float = 0.0) -> str:
-        """调用LLM"""
-        try:
-            response = ollama.chat(
-                model=self.llm_model,
-                messages=[{"role": "user", "content": prompt}],
-                options={
-                    "temperature": temperature,
-                    "num_predict": 3000
-                }
+        if len(items) > 1:
+            lines = "\n".join(
+                f"{i}. {label}: {', '.join(candidates[:MAX_BATCH_CANDIDATES])}"
+                for i, (label, candidates) in enumerate(items, 1)
             )
-            return response['message']['content'].strip()
-        except Exception as e:
-            logger.error(f"LLM调用失败: {e}")
-            return ""
+            prompt = self.prompts[batched_template].format(
+                question=question,
+                items=lines,
+                beam_width=self.beam_width
+            )
+            parsed = _parse_json_response(await self._acall_llm(prompt, model=self.aux_llm_model))
+            if isinstance(parsed, dict):
+                for i in range(len(items)):
+                    selected = parsed.get(str(i + 1))
+                    if isinstance(selected, list):
+                        selections[i] = [str(s).strip() for s in selected if str(s).strip()]
+
+        missing = [i for i, selected in enumerate(selections) if selected is None]
+        if missing:
+            if len(items) > 1:
+                logger.info("批量选择结果缺失 %s/%s 项,回退逐项调用", len(missing), len(items))
+            responses = await asyncio.gather(*(
+                self._acall_llm_list(single_prompts[i], self.beam_width, model=self.aux_llm_model)
+                for i in missing
+            ))
+            for i, selected in zip(missing, responses):
+                selections[i] = selected
+
+        return [selected[:self.beam_width] for selected in selections]
 
     # ============================================================
     # Phase 1: Initialization - 提取主题实体
     # ============================================================
 
-    def _extract_topic_entities(self, question: str) -> List[str]:
+    async def _extract_topic_entities(self, question: str) -> List[str]:
         """
         从问题中提取主题实体
         新增：使用 ywretriever 进行实体链接
         返回在知识图谱中匹配到的实体列表
         """
+        # Step 0: 问题原样包含足够长的图谱实体名时直接采用,省去LLM抽取与实体链接
+        if self.retriever:
+            try:
+                mentions = await asyncio.to_thread(self.retriever.find_mentions, question)
+            except Exception as e:
+                logger.warning("实体名直接匹配失败: %s", e)
+                mentions = []
+            # mentions 按长度降序,只看最长的一个;匹配太弱时仍交给LLM抽取
+            if mentions and len(mentions[0]) >= MENTION_MIN_COVERAGE * len(question.strip()):
+                matched_entities = mentions[:self.beam_width]
+                logger.info("问题中直接包含图谱实体,跳过LLM抽取: %s", matched_entities)
+                return matched_entities
+
         # Step 1: 使用LLM提取原始实体
         prompt = self.prompts["entity_extraction"].format(question=question)
-        response = self._call_llm(prompt)
+        response = await self._acall_llm(prompt, model=self.aux_llm_model)
         raw_entities = [e.strip() for e in response.split(",") if e.strip()]
 
-        logger.info(f"LLM提取的原始实体: {raw_entities}")
+        logger.info("LLM提取的原始实体: %s", raw_entities)
 
         # Step 2: 使用实体链接模块进行链接
         if self.retriever:
             try:
-                linked_entities = entity_linking(
+                linked_entities = await asyncio.to_thread(
+                    entity_linking,
                     retriever_obj=self.retriever,
                     entities=raw_entities,
                     threshold=self.entity_linking_threshold
                 )
-                logger.info(f"实体链接后的结果: {linked_entities}")
+                logger.info("实体链接后的结果: %s", linked_entities)
 
                 # 去重并限制数量
                 matched_entities = list(dict.fromkeys(linked_entities))[:self.beam_width]
 
             except Exception as e:
-                logger.error(f"实体链接失败: {e}, 使用原有匹配方法")
-                matched_entities = self._fallback_entity_matching(raw_entities)
+                logger.error("实体链接失败: %s, 使用原有匹配方法", e)
+                matched_entities = await asyncio.to_thread(self._fallback_entity_matching, raw_entities)
         else:
             # 如果检索器未初始化，使用原有的匹配方法
-            matched_entities = self._fallback_entity_matching(raw_entities)
+            matched_entities = await asyncio.to_thread(self._fallback_entity_matching, raw_entities)
 
-        logger.info(f"最终提取到的主题实体: {matched_entities}")
+        logger.info("最终提取到的主题实体: %s", matched_entities)
         return matched_entities
 
     def _fallback_entity_matching(self, raw_entities: List[str]) -> List[str]:
@@ -176,104 +464,121 @@ Answer:""",
     # Phase 2: Exploration - Beam Search探索
     # ============================================================
 
-    def _explore_relations(
+    async def _fetch_neighbor_index(self, entities: List[str]) -> Dict[str, Dict[str, List[str]]]:
+        """
+        一次批量查询获取所有实体按关系分组的一跳目标实体,供关系探索与实体探索共用
+
+        Returns:
+            {entity: {relation: [target_entities]}}
+        """
+        return await asyncio.to_thread(
+            self.neo4j.get_relation_targets_batch,
+            entities,
+            limit=MAX_TARGET_CANDIDATES,
+            relation_limit=MAX_BATCH_CANDIDATES
+        )
+
+    async def _explore_relations(
             self,
-            entities: List[str],
+            neighbor_index: Dict[str, Dict[str, List[str]]],
             question: str
     ) -> Dict[str, List[str]]:
         """
         关系探索:为每个实体找到最相关的关系
+        所有需要LLM剪枝的实体合并为一次批量选择
         返回: {entity: [selected_relations]}
         """
         entity_relations = {}
+        pending_items = []
+        pending_prompts = []
 
-        for entity in entities:
-            # Step 1: Search - 获取所有相关关系
-            neighbors = self.neo4j.get_entity_neighbors(entity, depth=1)
-
-            # 提取所有关系类型
-            all_relations = list(set([
-                n.get("relation") for n in neighbors
-                if n.get("relation")
-            ]))
-
-            if not all_relations:
-                entity_relations[entity] = []
-                continue
+        for entity, by_relation in neighbor_index.items():
+            # Step 1: Search - 实体的关系类型,批量与逐项提示词使用同一份候选
+            all_relations = list(by_relation)[:MAX_BATCH_CANDIDATES]
 
-            # Step 2: Prune - 使用LLM选择最相关的关系
+            # Step 2: Prune - 候选数不超过beam宽度时无需LLM选择
             if len(all_relations) <= self.beam_width:
-                selected_relations = all_relations
-            else:
-                prompt = self.prompts["relation_selection"].format(
-                    question=question,
-                    entities=entity,
-                    relations=", ".join(all_relations),
-                    beam_width=self.beam_width
-                )
-                response = self._call_llm(prompt)
-                selected_relations = [r.strip() for r in response.split(",") if r.strip()]
-                selected_relations = selected_relations[:self.beam_width]
+                entity_relations[entity] = all_relations
+                continue
 
+            pending_items.append((entity, all_relations))
+            pending_prompts.append(self.prompts["relation_selection"].format(
+                question=question,
+                entities=entity,
+                relations=", ".join(all_relations),
+                beam_width=self.beam_width
+            ))
+
+        # 使用LLM批量选择最相关的关系
+        selections = await self._select_candidates(
+            question, pending_items, pending_prompts, "relation_selection_batched"
+        )
+        for (entity, _), selected_relations in zip(pending_items, selections):
             entity_relations[entity] = selected_relations
-            logger.info(f"实体 '{entity}' 选择的关系: {selected_relations}")
+
+        if logger.isEnabledFor(logging.INFO):
+            for entity in neighbor_index:
+                logger.info("实体 '%s' 选择的关系: %s", entity, entity_relations[entity])
 
         return entity_relations
 
-    def _explore_entities(
+    async def _explore_entities(
             self,
             entity_relations: Dict[str, List[str]],
+            neighbor_index: Dict[str, Dict[str, List[str]]],
             question: str
     ) -> List[Dict[str, Any]]:
         """
         实体探索:为每个(实体,关系)对找到最相关的目标实体
+        所有需要LLM剪枝的(实体,关系)对合并为一次批量选择
         返回: [{"source": entity, "relation": rel, "targets": [entities]}]
         """
         exploration_results = []
+        pending_results = []
+        pending_prompts = []
 
         for source_entity, relations in entity_relations.items():
             for relation in relations:
-                # Step 1: Search - 获取所有目标实体
-                neighbors = self.neo4j.get_entity_neighbors(source_entity, depth=1)
-
-                # 过滤出使用该关系的邻居
-                target_candidates = [
-                    n.get("target_entity")
-                    for n in neighbors
-                    if n.get("relation") == relation and n.get("target_entity")
-                ]
+                # Step 1: Search - 使用该关系的目标实体,限制候选数量
+                target_candidates = neighbor_index[source_entity].get(relation, [])[:MAX_TARGET_CANDIDATES]
 
                 if not target_candidates:
                     continue
 
-                # 去重
-                target_candidates = list(dict.fromkeys(target_candidates))
+                result = {
+                    "source": source_entity,
+                    "relation": relation,
+                    "targets": target_candidates
+                }
+                exploration_results.append(result)
 
-                # Step 2: Prune - 使用LLM选择最相关的实体
-                if len(target_candidates) <= self.beam_width:
-                    selected_targets = target_candidates
-                else:
-                    prompt = self.prompts["entity_selection"].format(
+                # Step 2: Prune - 候选数不超过beam宽度时无需LLM选择
+                if len(target_candidates) > self.beam_width:
+                    pending_results.append(result)
+                    pending_prompts.append(self.prompts["entity_selection"].format(
                         question=question,
                         relation=relation,
-                        entities=", ".join(target_candidates[:20]),  # 限制候选数量
+                        entities=", ".join(target_candidates),
                         beam_width=self.beam_width
-                    )
-                    response = self._call_llm(prompt)
-                    selected_targets = [e.strip() for e in response.split(",") if e.strip()]
-                    selected_targets = selected_targets[:self.beam_width]
-
-                exploration_results.append({
-                    "source": source_entity,
-                    "relation": relation,
-                    "targets": selected_targets
-                })
+                    ))
+
+        # 使用LLM批量选择最相关的实体
+        selections = await self._select_candidates(
+            question,
+            [(f"{r['source']} --[{r['relation']}]-->", r["targets"]) for r in pending_results],
+            pending_prompts,
+            "entity_selection_batched"
+        )
+        for result, selected_targets in zip(pending_results, selections):
+            result["targets"] = selected_targets
 
-                logger.info(f"路径: {source_entity} --[{relation}]--> {selected_targets}")
+        if logger.isEnabledFor(logging.INFO):
+            for result in exploration_results:
+                logger.info("路径: %s --[%s]--> %s", result['source'], result['relation'], result['targets'])
 
         return exploration_results
 
-    def _beam_search_iteration(
+    async def _beam_search_iteration(
             self,
             current_paths: List[List[Dict]],
             question: str
@@ -294,16 +599,22 @@ Answer:""",
 
         if not tail_entities:
             # 初始化:从主题实体开始
-            topic_entities = self._extract_topic_entities(question)
+            topic_entities = await self._extract_topic_entities(question)
             # 创建初始路径(只包含实体,没有关系)
             current_paths = [[{"source": None, "relation": None, "target": e}] for e in topic_entities]
             tail_entities = topic_entities
 
+        # 多条路径可能停在同一尾实体,去重后每个实体只探索一次,结果按实体共享给各路径
+        tail_entities = list(dict.fromkeys(tail_entities))
+
+        # 每个尾实体只查询一次邻居,关系探索与实体探索共用
+        neighbor_index = await self._fetch_neighbor_index(tail_entities)
+
         # 1. 关系探索
-        entity_relations = self._explore_relations(tail_entities, question)
+        entity_relations = await self._explore_relations(neighbor_index, question)
 
         # 2. 实体探索
-        exploration_results = self._explore_entities(entity_relations, question)
+        exploration_results = await self._explore_entities(entity_relations, neighbor_index, question)
 
         # 3. 扩展路径
         new_paths = []
@@ -321,10 +632,68 @@ Answer:""",
                         }]
                         new_paths.append(new_path)
 
-        # 4. 保留top-N路径(beam width)
-        # 这里简单返回前N个,可以加入评分机制
+        # 4. 去重、剪枝并按与问题的相关度排序,保留top-N路径(beam width)
+        new_paths = await asyncio.to_thread(self._prune_paths, new_paths, question)
         return new_paths[:self.beam_width] if new_paths else current_paths
 
+    @staticmethod
+    def _char_bigrams(text: str) -> set:
+        """字符二元组集合,中英文通用的轻量相关度特征"""
+        text = text.lower()
+        return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+    def _score_tails(self, question: str, tails: List[str]) -> List[float]:
+        """
+        计算路径尾部文本与问题的相关度
+
+        有检索器时使用稠密向量余弦相似度(问题与所有尾部一次批量编码),
+        否则或编码失败时退化为字符二元组重合度
+
+        Args:
+            question: 用户问题
+            tails: 路径尾部 "关系 实体" 文本列表
+
+        Returns:
+            与 tails 顺序一致的相关度分数
+        """
+        if self.retriever and tails:
+            try:
+                vectors = self.retriever.encode([question] + tails)
+                return [cosine_similarity(vectors[0], vec) for vec in vectors[1:]]
+            except Exception as e:
+                logger.warning("路径向量评分失败: %s, 使用字符重合度评分", e)
+
+        question_grams = self._char_bigrams(question)
+        return [len(self._char_bigrams(tail) & question_grams) for tail in tails]
+
+    def _prune_paths(self, paths: List[List[Dict]], question: str) -> List[List[Dict]]:
+        """
+        路径去重与排序
+        1. 相同(关系,实体)序列的路径只保留一条
+        2. 丢弃尾实体回到路径中已访问实体的环路
+        3. 按尾部(关系,实体)与问题的相关度降序排列(稳定排序)
+        """
+        seen = set()
+        kept = []
+
+        for path in paths:
+            key = tuple((step["relation"], step["target"]) for step in path)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            tail = path[-1]
+            if any(step["target"] == tail["target"] for step in path[:-1]):
+                continue
+
+            kept.append(path)
+
+        scores = self._score_tails(
+            question, [f"{path[-1]['relation'] or ''} {path[-1]['target']}" for path in kept]
+        )
+        order = sorted(range(len(kept)), key=lambda i: scores[i], reverse=True)
+        return [kept[i] for i in order]
+
     # ============================================================
     # Phase 3: Reasoning - 评估和生成答案
     # ============================================================
@@ -333,29 +702,66 @@ Answer:""",
         """格式化路径用于显示"""
         formatted = []
         for i, path in enumerate(paths, 1):
-            path_str = " -> ".join([
+            path_str = " -> ".join(
                 f"({step['source']}) --[{step['relation']}]--> ({step['target']})"
                 for step in path if step['relation'] is not None
-            ])
+            )
             if path_str:
                 formatted.append(f"Path {i}: {path_str}")
         return "\n".join(formatted)
 
-    def _evaluate_sufficiency(self, question: str, paths: List[List[Dict]]) -> bool:
-        """评估当前路径是否足以回答问题"""
-        if not paths or not any(paths):
-            return False
+    async def _evaluate_and_answer(self, question: str, paths: List[List[Dict]]) -> Optional[str]:
+        """
+        评估当前路径是否足以回答问题,足够时在同一次LLM调用中直接给出答案
 
-        paths_text = self._format_paths(paths)
-        prompt = self.prompts["reasoning_evaluation"].format(
+        Args:
+            question: 用户问题
+            paths: 当前推理路径
+
+        Returns:
+            信息充足时返回答案,否则返回 None
+        """
+        if not paths or not any(paths):
+            return None
+
+        # 只含主题实体、尚无任何关系的路径不可能提供答案依据,无需询问LLM
+        useful_paths = [p for p in paths if any(step["relation"] for step in p)]
+        if not useful_paths:
+            return None
+
+        paths_text = self._format_paths(useful_paths[:MAX_EVALUATION_PATHS])
+
+        # 相同路径下的重复/近似问题直接复用评估结论;答案本身与具体问题相关,不跨问题复用
+        context_key = make_cache_key("evaluate_and_answer", self.llm_model, paths_text)
+        embed_fn = self.retriever.embed_query if self.retriever else None
+        cached = await asyncio.to_thread(evaluation_cache.get, context_key, question, embed_fn)
+        if cached == "no":
+            logger.info("充分性评估命中缓存: 信息不足")
+            return None
+        if cached == "yes":
+            logger.info("充分性评估命中缓存: 信息充足")
+            return await self._generate_answer(question, paths)
+
+        prompt = self.prompts["evaluate_and_answer"].format(
             question=question,
             paths=paths_text
         )
+        response = await self._acall_llm(prompt, temperature=0.1)
+        if not response:
+            return None
+
+        match = _ANSWER_RE.search(response)
+        answer = match.group(1).strip() if match else None
+        if answer is None and not _INSUFFICIENT_RE.search(response):
+            # 未按约定格式输出,不缓存结论
+            return None
+
+        await asyncio.to_thread(
+            evaluation_cache.set, context_key, question, "yes" if answer else "no", embed_fn
+        )
+        return answer or None
 
-        response = self._call_llm(prompt).lower()
-        return "yes" in response
-
-    def _generate_answer(self, question: str, paths: List[List[Dict]]) -> str:
+    async def _generate_answer(self, question: str, paths: List[List[Dict]]) -> str:
         """基于路径生成答案"""
         paths_text = self._format_paths(paths)
         prompt = self.prompts["answer_generation"].format(
@@ -363,7 +769,7 @@ Answer:""",
             paths=paths_text
         )
 
-        answer = self._call_llm(prompt, temperature=0.1)
+        answer = await self._acall_llm(prompt, temperature=0.1)
         return answer
 
     # ============================================================
@@ -376,6 +782,23 @@ Answer:""",
             max_depth: Optional[int] = None,
             max_width: Optional[int] = None,
             **kwargs  # 兼容旧接口
+    ) -> Dict[str, Any]:
+        """ToG主推理流程的同步入口,供非异步调用方使用,参数与返回值同 areason"""
+        async def run():
+            try:
+                return await self.areason(question, max_depth=max_depth, max_width=max_width, **kwargs)
+            finally:
+                # asyncio.run 结束后事件循环即关闭,在此之前释放绑定该循环的客户端
+                await close_llm_client()
+
+        return asyncio.run(run())
+
+    async def areason(
+            self,
+            question: str,
+            max_depth: Optional[int] = None,
+            max_width: Optional[int] = None,
+            **kwargs  # 兼容旧接口
     ) -> Dict[str, Any]:
         """
         ToG主推理流程
@@ -394,25 +817,29 @@ Answer:""",
         depth_limit = max_depth if max_depth is not None else self.max_depth
         beam_width = max_width if max_width is not None else self.beam_width
 
+        # 信号量限制单次推理的并发,绑定当前事件循环,每次推理重新创建;LLM客户端跨推理共享
+        self._llm_semaphore = asyncio.Semaphore(self.llm_concurrency)
+
         try:
-            logger.info(f"开始ToG推理 - 问题: {question}")
-            logger.info(f"参数: max_depth={depth_limit}, beam_width={beam_width}")
+            logger.info("开始ToG推理 - 问题: %s", question)
+            logger.info("参数: max_depth=%s, beam_width=%s", depth_limit, beam_width)
             if self.neo4j.grag_id:
-                logger.info(f"数据隔离: grag_id={self.neo4j.grag_id}")
+                logger.info("数据隔离: grag_id=%s", self.neo4j.grag_id)
 
             # Phase 1: Initialization
             current_paths = []
             reasoning_history = []
+            answer = None
 
             # Phase 2 & 3: Iterative Exploration and Reasoning
             for depth in range(depth_limit):
-                logger.info(f"========== 深度 {depth + 1}/{depth_limit} ==========")
+                logger.info("========== 深度 %s/%s ==========", depth + 1, depth_limit)
 
                 # Exploration
-                current_paths = self._beam_search_iteration(current_paths, question)
+                current_paths = await self._beam_search_iteration(current_paths, question)
 
                 if not current_paths:
-                    logger.warning(f"深度 {depth + 1}: 无法继续探索")
+                    logger.warning("深度 %s: 无法继续探索", depth + 1)
                     break
 
                 # 记录当前深度的路径
@@ -422,14 +849,16 @@ Answer:""",
                     "num_paths": len(current_paths)
                 })
 
-                # Reasoning: 评估是否可以回答
-                if self._evaluate_sufficiency(question, current_paths):
-                    logger.info(f"深度 {depth + 1}: 信息充足,开始生成答案")
+                # Reasoning: 评估是否可以回答,可以时同时得到答案
+                answer = await self._evaluate_and_answer(question, current_paths)
+                if answer:
+                    logger.info("深度 %s: 信息充足,已生成答案", depth + 1)
                     break
 
-            # Generate Answer
+            # Generate Answer: 达到深度上限仍未得到答案时基于现有路径作答
             if current_paths:
-                answer = self._generate_answer(question, current_paths)
+                if not answer:
+                    answer = await self._generate_answer(question, current_paths)
                 success = True
             else:
                 answer = "无法从知识图谱中找到足够的信息来回答该问题。"
@@ -446,7 +875,7 @@ Answer:""",
             }
 
         except Exception as e:
-            logger.error(f"推理过程出错: {e}", exc_info=True)
+            logger.error("推理过程出错: %s", e, exc_info=True)
             return {
                 "success": False,
                 "question": question,
@@ -1,9 +1,73 @@
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.embeddings import ModelScopeEmbeddings
 from langchain_core.documents import Document
+from modelscope.pipelines import pipeline
+from modelscope.utils.constant import Tasks
+import faiss
+import numpy as np
 import pandas as pd
 import os
-from typing import List
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+EMBEDDING_MODEL_ID = "iic/nlp_corom_sentence-embedding_chinese-base"
+
+# 编码设备（如 "cuda:0"、"cpu"）；未设置时沿用 ModelScope 的默认选择
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "")
+
+# 编码模型实例：按 model_id 进程内共享，避免每次建索引/加载检索器都重新加载模型
+_embeddings_by_model: Dict[str, ModelScopeEmbeddings] = {}
+_embeddings_lock = threading.Lock()
+
+# 查询向量缓存：跨 Retriever 实例共享，避免重复编码相同的实体名
+EMBEDDING_CACHE_SIZE = 4096
+_embedding_cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+# 检索结果缓存：按 ((索引目录, 索引文件修改时间), 查询文本, top_k) 缓存 FAISS 检索结果，跨请求复用。
+# 键中带修改时间，任一进程重建索引后其他进程加载到新索引即不再命中旧结果；本进程重建时另按目录主动清除
+SEARCH_CACHE_SIZE = 4096
+_search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+# 实体名索引：按 (索引目录, 索引文件修改时间) 缓存 (名称 -> 文档, 按长度降序的名称列表)，跨请求复用；
+# 每个目录只保留最新的一份，与检索结果缓存一同失效
+_name_indexes: Dict[tuple, tuple] = {}
+_name_indexes_lock = threading.Lock()
+
+# 建索引时每次送入编码器的文本数
+EMBEDDING_BATCH_SIZE = 128
+
+# HNSW 索引参数：每个节点的邻接数、建图与查询时的候选队列长度
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# 在问题文本中直接匹配实体名时，名称的最小长度（过短的名称容易误命中）
+MIN_MENTION_LENGTH = 3
+
+
+def _get_embeddings(model_id: str = EMBEDDING_MODEL_ID) -> ModelScopeEmbeddings:
+    """获取共享的编码模型实例，首次使用时加载"""
+    with _embeddings_lock:
+        embeddings = _embeddings_by_model.get(model_id)
+        if embeddings is None:
+            embeddings = _embeddings_by_model[model_id] = _load_embeddings(model_id)
+        return embeddings
+
+
+def _load_embeddings(model_id: str) -> ModelScopeEmbeddings:
+    """加载编码模型；指定了 EMBEDDING_DEVICE 时把 pipeline 放到该设备上"""
+    if not EMBEDDING_DEVICE:
+        return ModelScopeEmbeddings(model_id=model_id)
+    # ModelScopeEmbeddings 的构造函数不接受 device 参数，这里跳过它自带的 pipeline 构造，
+    # 直接注入指定设备的 pipeline，避免模型被加载两次
+    embed = pipeline(Tasks.sentence_embedding, model=model_id, device=EMBEDDING_DEVICE)
+    return ModelScopeEmbeddings.model_construct(model_id=model_id, embed=embed)
 
 
 def crtDenseRetriever(retriv_dir: str, file_path: str):
@@ -17,53 +81,212 @@ def crtDenseRetriever(retriv_dir: str, file_path: str):
     Returns:
         retriv_dir：向量索引保存目录 (例如: ../graphrag/{grag_id}/..retrive)
     """
-    model_name = "iic/nlp_corom_sentence-embedding_chinese-base"
-    embeddings = ModelScopeEmbeddings(model_id=model_name)
+    embeddings = _get_embeddings()
 
     # 检查文件是否存在
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"CSV文件不存在: {file_path}")
 
-    df = pd.read_csv(file_path)
+    # 名称缺失的节点不建索引，否则 astype(str) 会把缺失值变成字面量 "nan" 当作实体编码
+    df = pd.read_csv(file_path).dropna(subset=["name"])
+    if df.empty:
+        raise ValueError(f"CSV文件中没有节点数据: {file_path}")
 
-    documents = []
-    for _, row in df.iterrows():
-        doc = Document(
-            page_content=row["name"],
-            metadata={"id": row["id"]}
-        )
-        documents.append(doc)
+    # 按列取值构建文档，避免 iterrows 逐行构造 Series
+    documents = [
+        Document(page_content=name, metadata={"id": node_id})
+        for name, node_id in zip(df["name"].astype(str).tolist(), df["id"].tolist())
+    ]
 
     # 如果目录不存在，创建目录
     os.makedirs(retriv_dir, exist_ok=True)
 
-    vectorstore = FAISS.from_documents(
-        documents=documents,
-        embedding=embeddings
+    # 分块批量编码后直接用向量建索引
+    texts = [doc.page_content for doc in documents]
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(embeddings.embed_documents(texts[start:start + EMBEDDING_BATCH_SIZE]))
+
+    # HNSW 图索引：查询耗时随节点数近似对数增长；沿用 L2 距离，与实体链接阈值的含义保持一致
+    # 向量以 8bit 标量量化存储，索引体积与扫描带宽约为 FP32 的 1/4
+    matrix = np.asarray(vectors, dtype=np.float32)
+    index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(matrix)
+    index.add(matrix)
+
+    doc_ids = [str(uuid.uuid4()) for _ in documents]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(doc_ids, documents))),
+        index_to_docstore_id=dict(enumerate(doc_ids))
     )
 
     vectorstore.save_local(retriv_dir)
+    invalidate_search_cache(retriv_dir)
     print(f"✓ 索引创建成功: {retriv_dir}")
     return retriv_dir
 
 
+def _index_stamp(retriv_dir: str) -> int:
+    """索引文件的修改时间(纳秒)，文件不存在时返回 0"""
+    try:
+        return os.stat(os.path.join(retriv_dir, "index.faiss")).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def invalidate_search_cache(retriv_dir: str):
+    """清除指定索引目录的检索结果缓存与实体名索引（索引重建后调用）"""
+    source = os.path.abspath(retriv_dir)
+    with _search_cache_lock:
+        for key in [key for key in _search_cache if key[0][0] == source]:
+            del _search_cache[key]
+    with _name_indexes_lock:
+        for key in [key for key in _name_indexes if key[0] == source]:
+            del _name_indexes[key]
+
+
 class LangChainDenseRetriever:
-    def __init__(self, vectorstore, top_k: int = 5):
+    def __init__(self, vectorstore, top_k: int = 5, embeddings=None, source: Optional[str] = None, stamp: int = 0):
         self.vectorstore = vectorstore
         self.top_k = top_k
+        self.embeddings = embeddings
+        # (索引目录, 加载时的索引文件修改时间)，用作检索结果与实体名索引缓存的命名空间；无目录时不跨实例缓存
+        self.cache_namespace = (os.path.abspath(source), stamp) if source else None
+        self._name_index_cache = None
 
     @classmethod
     def load(cls, retriever_version: str, top_k: int = 5):
-        embeddings = ModelScopeEmbeddings(model_id="iic/nlp_corom_sentence-embedding_chinese-base")
+        embeddings = _get_embeddings()
+        stamp = _index_stamp(retriever_version)
         vectorstore = FAISS.load_local(
             retriever_version,
             embeddings,
             allow_dangerous_deserialization=True
         )
-        return cls(vectorstore, top_k)
+        # 加载后统一设置查询时的候选队列长度，使已保存的索引也使用当前配置；旧的 Flat 索引无此属性
+        if hasattr(vectorstore.index, "hnsw"):
+            vectorstore.index.hnsw.efSearch = HNSW_EF_SEARCH
+        return cls(vectorstore, top_k, embeddings, source=retriever_version, stamp=stamp)
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """批量编码文本，命中缓存的跳过，未命中的一次性批量编码"""
+        keys = [(EMBEDDING_MODEL_ID, text) for text in texts]
+        vectors = {}
+        with _embedding_cache_lock:
+            for key in keys:
+                vec = _embedding_cache.get(key)
+                if vec is not None:
+                    _embedding_cache.move_to_end(key)
+                    vectors[key] = vec
+
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if missing:
+            new_vectors = self.embeddings.embed_documents([text for _, text in missing])
+            with _embedding_cache_lock:
+                for key, vec in zip(missing, new_vectors):
+                    vectors[key] = vec
+                    _embedding_cache[key] = vec
+                    _embedding_cache.move_to_end(key)
+                while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    _embedding_cache.popitem(last=False)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, query: str) -> List[float]:
+        return self.encode([query])[0]
+
+    def _build_name_index(self) -> tuple:
+        docstore = self.vectorstore.docstore
+        docs_by_name = {}
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            doc = docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs_by_name[doc.page_content] = doc
+        names_by_length = sorted(
+            (name for name in docs_by_name if len(name) >= MIN_MENTION_LENGTH),
+            key=len,
+            reverse=True
+        )
+        return docs_by_name, names_by_length
+
+    def _name_index(self) -> tuple:
+        """获取 (名称 -> 文档, 按长度降序的名称列表)，有索引目录时跨实例共享"""
+        namespace = self.cache_namespace
+        if namespace is None:
+            if self._name_index_cache is None:
+                self._name_index_cache = self._build_name_index()
+            return self._name_index_cache
+        with _name_indexes_lock:
+            index = _name_indexes.get(namespace)
+        if index is None:
+            index = self._build_name_index()
+            with _name_indexes_lock:
+                # 同一目录更早版本的索引已被重建替换，不再保留
+                for key in [key for key in _name_indexes if key[0] == namespace[0] and key[1] < namespace[1]]:
+                    del _name_indexes[key]
+                index = _name_indexes.setdefault(namespace, index)
+        return index
+
+    def exact_match(self, query: str) -> Optional[Document]:
+        """按名称精确匹配索引中的文档（无需编码）"""
+        return self._name_index()[0].get(query)
+
+    def find_mentions(self, text: str) -> List[str]:
+        """找出原样出现在文本中的索引实体名（长名优先，已被更长实体名包含的短名跳过）"""
+        mentions = []
+        for name in self._name_index()[1]:
+            if name in text and not any(name in mention for mention in mentions):
+                mentions.append(name)
+        return mentions
 
     def search_with_score(self, query: str):
-        return self.vectorstore.similarity_search_with_score(query, k=self.top_k)
+        return self.search_batch_with_score([query])[0]
+
+    def search_batch_with_score(self, queries: List[str]) -> List[List[tuple]]:
+        """批量检索：命中缓存的查询直接返回，其余查询一次编码、一次 FAISS 搜索"""
+        if not queries:
+            return []
+        # 去掉首尾空白后同时用于缓存键与编码，只差空白的查询共享同一结果
+        queries = [query.strip() for query in queries]
+        keys = [(self.cache_namespace, query, self.top_k) for query in queries]
+        results: List[Optional[List[tuple]]] = [None] * len(queries)
+        if self.cache_namespace is not None:
+            with _search_cache_lock:
+                for i, key in enumerate(keys):
+                    hits = _search_cache.get(key)
+                    if hits is not None:
+                        _search_cache.move_to_end(key)
+                        results[i] = list(hits)
+
+        missing = [i for i, hits in enumerate(results) if hits is None]
+        if not missing:
+            return results
+        vectors = np.asarray(self.encode([queries[i] for i in missing]), dtype=np.float32)
+        scores, indices = self.vectorstore.index.search(vectors, self.top_k)
+
+        docstore = self.vectorstore.docstore
+        index_to_id = self.vectorstore.index_to_docstore_id
+        for i, row_scores, row_indices in zip(missing, scores, indices):
+            hits = []
+            for score, idx in zip(row_scores, row_indices):
+                if idx == -1:
+                    continue
+                doc = docstore.search(index_to_id[idx])
+                if isinstance(doc, Document):
+                    hits.append((doc, float(score)))
+            results[i] = hits
+
+        if self.cache_namespace is not None:
+            with _search_cache_lock:
+                for i in missing:
+                    _search_cache[keys[i]] = tuple(results[i])
+                    _search_cache.move_to_end(keys[i])
+                while len(_search_cache) > SEARCH_CACHE_SIZE:
+                    _search_cache.popitem(last=False)
+        return results
 
 
 class Retriever:
@@ -74,7 +297,25 @@ class Retriever:
             raise ValueError("Invalid retriever type")
 
     def retrieve(self, query: str):
-        return self.retriever.search_with_score(query)
+        return self.retriever.search_batch_with_score([query])[0]
+
+    def retrieve_batch(self, queries: List[str]):
+        """批量检索，返回与 queries 顺序一致的 [(Document, score)] 列表"""
+        return self.retriever.search_batch_with_score(queries)
+
+    def embed_query(self, query: str) -> List[float]:
+        """获取查询文本的稠密向量（供语义缓存等复用同一编码器）"""
+        return self.retriever.embed_query(query)
+
+    def encode(self, queries: List[str]) -> List[List[float]]:
+        """批量获取查询文本的稠密向量"""
+        return self.retriever.encode(queries)
+
+    def exact_match(self, query: str) -> Optional[Document]:
+        return self.retriever.exact_match(query)
+
+    def find_mentions(self, text: str) -> List[str]:
+        return self.retriever.find_mentions(text)
 
 
 def entity_linking(retriever_obj: Retriever, entities: list[str], threshold: float = 10) -> list[str]:
@@ -82,13 +323,17 @@ def entity_linking(retriever_obj: Retriever, entities: list[str], threshold: flo
     实体链接 - 简洁版输出
     """
     results = []
+    # 输出先缓存，最后一次性写出
+    lines = ["", "=" * 60, "【实体链接结果】", "-" * 60]
 
-    print("\n" + "=" * 60)
-    print("【实体链接结果】")
-    print("-" * 60)
+    # 精确匹配的实体无需编码，其余实体一次批量编码并检索
+    exact_docs = {ent: retriever_obj.exact_match(ent) for ent in entities}
+    pending = [ent for ent, doc in exact_docs.items() if doc is None]
+    search_results = dict(zip(pending, retriever_obj.retrieve_batch(pending)))
 
     for ent in entities:
-        search_res = retriever_obj.retrieve(ent)
+        exact_doc = exact_docs[ent]
+        search_res = [(exact_doc, 0.0)] if exact_doc is not None else search_results[ent]
         if search_res:
             doc, score = search_res[0]
             results.append(doc.page_content)
@@ -100,7 +345,8 @@ def entity_linking(retriever_obj: Retriever, entities: list[str], threshold: flo
                 status = "✗"
                 match_type = "超阈值"
 
-            print(f"{status} {ent:20s} -> {doc.page_content:20s} [{match_type}] (距离: {score:.2f})")
+            lines.append(f"{status} {ent:20s} -> {doc.page_content:20s} [{match_type}] (距离: {score:.2f})")
 
-    print("=" * 60 + "\n")
+    lines.append("=" * 60 + "\n")
+    sys.stdout.write("\n".join(lines) + "\n")
     return results